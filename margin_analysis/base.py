@@ -1,3 +1,6 @@
+import numpy as np
+
+
 class Exchange:
     CFFEX = 'CFFEX'
     SSE = 'SSE'
@@ -8,28 +11,27 @@ class Exchange:
     GFEX = 'GFEX'
 
     EquityExchanges = {CFFEX, SSE, SZSE}
+    ETFExchanges = {SSE, SZSE}
     CommodityExchanges = {SHFE, DCE, CZCE, GFEX}
 
     @staticmethod
     def from_code(exchange_code: str) -> str:
         exchange_code = exchange_code.upper()
-        match exchange_code:
-            case 'CFE' | 'CCFX' | 'CFFEX':
-                return Exchange.CFFEX
-            case 'SH' | 'XSHG':
-                return Exchange.SSE
-            case 'SZ' | 'XSHE':
-                return Exchange.SZSE
-            case 'SHFE' | 'XSGE':
-                return Exchange.SHFE
-            case 'DZCE' | 'XZCE':
-                return Exchange.CZCE
-            case 'DCE' |'XDCE':
-                return Exchange.DCE
-            case 'GFEX':
-                return Exchange.GFEX
-            case _:
-                raise ValueError(f'Invalid exchange code: {exchange_code}.')
+        try:
+            return _EXCHANGE_ALIASES[exchange_code]
+        except KeyError:
+            raise ValueError(f'Invalid exchange code: {exchange_code}.')
+
+
+_EXCHANGE_ALIASES = {
+    'CFE': Exchange.CFFEX, 'CCFX': Exchange.CFFEX, 'CFFEX': Exchange.CFFEX,
+    'SH': Exchange.SSE, 'XSHG': Exchange.SSE,
+    'SZ': Exchange.SZSE, 'XSHE': Exchange.SZSE,
+    'SHFE': Exchange.SHFE, 'XSGE': Exchange.SHFE,
+    'DZCE': Exchange.CZCE, 'XZCE': Exchange.CZCE,
+    'DCE': Exchange.DCE, 'XDCE': Exchange.DCE,
+    'GFEX': Exchange.GFEX,
+}
 
 
 class PositionType:
@@ -71,13 +73,27 @@ class Variety:
 
     @staticmethod
     def is_commodity_pair(variety1: str, variety2: str, exchange: str) -> bool:
-        if (
-            exchange not in Variety.CommodityPairs or
-            variety1 not in Variety.CommodityVarieties[exchange] or
-            variety2 not in Variety.CommodityVarieties[exchange]
-        ):
-            return False
-        return frozenset((variety1, variety2)) in Variety.CommodityPairs[exchange]
+        # CommodityPairs 中的品种均属于对应交易所, 一次集合查找即可判定
+        return frozenset((variety1, variety2)) in Variety.CommodityPairs.get(exchange, ())
+
+    @staticmethod
+    def is_commodity_pair_vec(variety1: np.ndarray, variety2: np.ndarray,
+                              exchange: np.ndarray) -> np.ndarray:
+        """
+        is_commodity_pair 的向量化版本
+
+        Args:
+            variety1 (ndarray): 第一笔持仓的品种, shape: (n_pair,)
+            variety2 (ndarray): 第二笔持仓的品种, shape: (n_pair,)
+            exchange (ndarray): 交易所, shape: (n_pair,)
+
+        Returns:
+            ndarray: 各组品种是否可构成跨品种组合, shape: (n_pair,)
+        """
+        id1 = _commodity_variety_ids(exchange, variety1)
+        id2 = _commodity_variety_ids(exchange, variety2)
+        valid = (id1 >= 0) & (id2 >= 0)
+        return valid & _COMMODITY_PAIR_MATRIX[np.where(valid, id1, 0), np.where(valid, id2, 0)]
 
     CommodityPairs = {
         'CZCE': set(),
@@ -92,3 +108,28 @@ class Variety:
             frozenset(('EG', 'PG')), frozenset(('EB', 'PG')),
         },
     }
+
+
+# 商品期货 (交易所, 品种) 的整数编号, 及按编号索引的跨品种组合矩阵
+_COMMODITY_VARIETY_IDS = {
+    (exchange, variety): idx for idx, (exchange, variety) in enumerate(
+        (exchange, variety)
+        for exchange, varieties in Variety.CommodityVarieties.items()
+        for variety in sorted(varieties))
+}
+_COMMODITY_PAIR_MATRIX = np.zeros((len(_COMMODITY_VARIETY_IDS),) * 2, dtype=bool)
+for _exchange, _pairs in Variety.CommodityPairs.items():
+    for _v1, _v2 in _pairs:
+        _id1 = _COMMODITY_VARIETY_IDS[(_exchange, _v1)]
+        _id2 = _COMMODITY_VARIETY_IDS[(_exchange, _v2)]
+        _COMMODITY_PAIR_MATRIX[_id1, _id2] = _COMMODITY_PAIR_MATRIX[_id2, _id1] = True
+
+
+def _commodity_variety_ids(exchange: np.ndarray, variety: np.ndarray) -> np.ndarray:
+    """查询 (交易所, 品种) 的整数编号, 不存在的返回 -1"""
+    labels, inverse = np.unique(
+        np.stack([np.asarray(exchange, dtype=str), np.asarray(variety, dtype=str)], axis=1),
+        axis=0, return_inverse=True)
+    ids = np.array([_COMMODITY_VARIETY_IDS.get(tuple(label), -1) for label in labels],
+                   dtype=np.int64)
+    return ids[inverse.ravel()]
@@ -1,49 +1,160 @@
+import hashlib
+import os
 import re
-from typing import Optional
+from typing import Any, Callable, Optional
+import numpy as np
 import pandas as pd
 from base import Exchange, PositionType
 from margin_utils import MarginCalculator, process_larger_side_margin
 
 
+# 持仓代码正则 (模块加载时预编译)
+_RE_CFFEX_FUTURE = re.compile(r'^(I[FCMH])[0-9]{4}$')
+_RE_CFFEX_OPTION = re.compile(r'^([IMH]O)[0-9]{4}.')
+_RE_ETF_OPTION1 = re.compile(r'^[0-9]{8}$')
+_RE_ETF_OPTION2 = re.compile(r'^[0-9]{6}(?:[CP]|-[CP]-).')
+_RE_COMMODITY_FUTURE = re.compile(r'^([A-Za-z]+)[0-9]{4}$')
+_RE_COMMODITY_OPTION = re.compile(r'^([A-Za-z]+)[0-9]{4}(?:[CP]|-[CP]-).')
+
+
 class DataLoader:
     @staticmethod
-    def load_params(params_excel: str
+    def load_params(params_excel: str, cache_dir: Optional[str] = None,
+                    engine: Optional[str] = None
                     ) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame]:
-        margin_ratio_df = pd.read_excel(params_excel, sheet_name='marginRatio').set_index('Variety')
-        supplement = pd.read_excel(params_excel, sheet_name='supplement').set_index('Account')
-        cov = pd.read_excel(params_excel, sheet_name='cov').set_index('Underlying')
-        mu = pd.read_excel(params_excel, sheet_name='mu').set_index('Underlying')
+        sheet_name = ['marginRatio', 'supplement', 'cov', 'mu']
+        sheets = _read_with_cache(
+            params_excel, cache_dir,
+            lambda: pd.read_excel(params_excel, sheet_name=sheet_name, engine=engine),
+            options={'sheet_name': sheet_name, 'engine': engine})
+        margin_ratio_df = sheets['marginRatio'].set_index('Variety')
+        supplement = sheets['supplement'].set_index('Account')
+        cov = sheets['cov'].set_index('Underlying')
+        mu = sheets['mu'].set_index('Underlying')
         return margin_ratio_df, supplement, cov, mu
 
     @staticmethod
-    def load_account(account_excel: str) -> pd.DataFrame:
-        margin_account = pd.read_excel(account_excel).dropna()
-        margin_account = margin_account[['持仓帐号', '权益']]
+    def load_account(account_excel: str, cache_dir: Optional[str] = None,
+                     engine: Optional[str] = None) -> pd.DataFrame:
+        usecols = ['持仓帐号', '权益']
+        dtype = {'权益': np.float64}
+        margin_account = _read_with_cache(
+            account_excel, cache_dir,
+            lambda: pd.read_excel(account_excel, usecols=usecols, dtype=dtype, engine=engine),
+            options={'usecols': usecols, 'dtype': dtype, 'engine': engine}
+        ).dropna(subset=usecols)
         margin_account.rename(columns={'持仓帐号': 'account', '权益': 'equity'}, inplace=True)
         margin_account.set_index('account', inplace=True)
         return margin_account
 
     @staticmethod
-    def load_holding(holding_excel: str) -> pd.DataFrame:
-        holding = pd.read_excel(holding_excel).dropna()
+    def load_holding(holding_excel: str, cache_dir: Optional[str] = None,
+                     engine: Optional[str] = None) -> pd.DataFrame:
+        """
+        读取持仓 Excel
+
+        Args:
+            holding_excel (str): 持仓文件路径
+            cache_dir (str, optional): 解析结果缓存目录
+            engine (str, optional): Excel 解析引擎; pandas>=2.2 且安装 python-calamine 后
+                可传入 'calamine', 解析速度远快于默认的 openpyxl
+        """
+        dtype = {'代码': str}
+        holding = _read_with_cache(
+            holding_excel, cache_dir,
+            lambda: pd.read_excel(holding_excel, dtype=dtype, engine=engine),
+            options={'dtype': dtype, 'engine': engine}).dropna()
+        # 持仓手数为整数, 剔除缺失值后以 int32 存储, 减半后续拆分与合并的数据量
+        for col in ['多头持仓', '空头持仓']:
+            if (holding[col] % 1 == 0).all():
+                holding[col] = holding[col].astype(np.int32)
         holding.sort_values(by=['持仓帐号', '代码'], ignore_index=True, inplace=True)
         return holding
 
     @staticmethod
-    def load_market_data(market_data_csv: str, encoding: Optional[str] = None) -> pd.DataFrame:
-        market_data = pd.read_csv(market_data_csv, encoding=encoding).dropna()
+    def load_market_data(market_data_csv: str, encoding: Optional[str] = None,
+                         cache_dir: Optional[str] = None,
+                         engine: Optional[str] = None,
+                         usecols: Optional[list[str]] = None) -> pd.DataFrame:
+        """
+        读取行情数据 CSV
+
+        Args:
+            market_data_csv (str): 行情数据文件路径
+            encoding (str, optional): 文件编码
+            cache_dir (str, optional): 解析结果缓存目录
+            engine (str, optional): CSV 解析引擎; 安装 pyarrow 后可传入 'pyarrow' 以多线程解析,
+                此时日期列会被解析为 date 对象
+            usecols (list, optional): 只读取的列, 缺失值也只在这些列上剔除
+        """
+        market_data = _read_with_cache(
+            market_data_csv, cache_dir,
+            lambda: pd.read_csv(market_data_csv, encoding=encoding, engine=engine,
+                                usecols=usecols),
+            options={'usecols': usecols, 'encoding': encoding, 'engine': engine}
+        ).dropna(subset=usecols)
         return market_data
 
 
+def _read_with_cache(source: str, cache_dir: Optional[str], read: Callable[[], Any],
+                     options: Any = None) -> Any:
+    """
+    读取原始文件, 并以 pickle 缓存解析结果
+
+    Args:
+        source (str): 原始文件路径
+        cache_dir (str, optional): 缓存目录, 为 None 时不使用缓存
+        read (Callable): 解析原始文件的函数
+        options (Any, optional): 影响解析结果的读取参数, 计入缓存键
+
+    Returns:
+        Any: 解析结果; 缓存键 (原始文件绝对路径、修改时间、大小与读取参数) 一致时直接读取缓存,
+            否则重新解析并写入缓存, 同时删除该文件名下的其他缓存
+    """
+    if cache_dir is None:
+        return read()
+    path = os.path.abspath(source)
+    stat = os.stat(path)
+    key = repr((path, stat.st_mtime_ns, stat.st_size, options))
+    basename = os.path.basename(source)
+    name = basename + '.' + hashlib.md5(key.encode()).hexdigest()[:8] + '.pkl'
+    cache = os.path.join(cache_dir, name)
+    if os.path.exists(cache):
+        return pd.read_pickle(cache)
+    data = read()
+
+    # 先写临时文件再原子替换, 避免写入中断留下键值一致但内容残缺的缓存
+    os.makedirs(cache_dir, exist_ok=True)
+    temp = f'{cache}.{os.getpid()}.tmp'
+    try:
+        pd.to_pickle(data, temp)
+        os.replace(temp, cache)
+    finally:
+        if os.path.exists(temp):
+            os.remove(temp)
+    # 清理同一原始文件已失效的旧缓存
+    pattern = re.compile(re.escape(basename) + r'\.[0-9a-f]{8}\.pkl')
+    for entry in os.listdir(cache_dir):
+        if entry != name and pattern.fullmatch(entry):
+            os.remove(os.path.join(cache_dir, entry))
+    return data
+
+
 class HoldingDataProcessor:
+    FUTURES_DATA_COLUMNS = ['future_code', 'last_tradedate', 'multiplier', 'close_price']
+    OPTIONS_DATA_COLUMNS = ['option_code', 'option_mark_code', 'last_tradedate', 'call_put',
+                            'strike_price', 'multiplier', 'close_price', 'udl_price',
+                            'delta', 'gamma']
+
     def __init__(self, holding: pd.DataFrame,
                  margin_ratio_df: pd.DataFrame,
                  stock_futures_data: Optional[pd.DataFrame] = None,
                  stock_options_data: Optional[pd.DataFrame] = None,
                  commodity_futures_data: Optional[pd.DataFrame] = None,
                  commodity_options_data: Optional[pd.DataFrame] = None):
-        self.holding = holding.copy()
+        self.holding = holding
         self.margin_ratio_df = margin_ratio_df
+        self.margin_ratio = margin_ratio_df['MarginRatio']    # 品种 -> 保证金比例
         self.stock_futures_data = stock_futures_data
         self.stock_options_data = stock_options_data
         self.commodity_futures_data = commodity_futures_data
@@ -51,91 +162,82 @@ class HoldingDataProcessor:
 
     def process(self) -> pd.DataFrame:
         """处理持仓数据: 补充市场数据, 拆分多空方向持仓, 计算保证金"""
-        self.holding.rename(columns={'代码': 'code', '持仓帐号': 'account'}, inplace=True)
-        self.holding[['exchange', 'type', 'variety']] = self.holding['code'].apply(
-            lambda code: pd.Series(parse_position_code(code)))
+        # 浅拷贝后原地重命名: 共享调用方持仓的数据, 但不修改其列索引
+        holding = self.holding.copy(deep=False)
+        holding.rename(columns={'代码': 'code', '持仓帐号': 'account'}, inplace=True)
+        holding[['exchange', 'type', 'variety']] = parse_position_codes(holding['code'])
 
         # 补充市场数据
-        holding_futures = self.holding[self.holding['type'] == PositionType.Future].copy()
-        holding_options = self.holding[self.holding['type'] == PositionType.Option].copy()
-        if not holding_futures.empty:
-            holding_futures = self._merge_futures_data(holding_futures)
-        if not holding_options.empty:
-            holding_options = self._merge_options_data(holding_options)
-        dfs_to_concat = [df for df in [holding_futures, holding_options] if not df.empty]
-        holding = pd.concat(dfs_to_concat, ignore_index=True)
+        dfs_to_concat = [df for df in [self._get_futures_data(), self._get_options_data()]
+                         if not df.empty]
+        market_data = pd.concat(dfs_to_concat, ignore_index=True).set_index('code')
+        # 只提供期货或期权数据时, 另一类独有的字段以空值补齐
+        market_data = market_data.reindex(columns=list(dict.fromkeys(
+            self.FUTURES_DATA_COLUMNS[1:] + ['udl'] + self.OPTIONS_DATA_COLUMNS[2:])))
+        holding = holding.join(market_data, on='code', how='left', validate='m:1')
+        # 期货持仓排在期权持仓之前 (稳定排序, 保持各类内部的原有顺序)
+        is_future = (holding['type'] == PositionType.Future).to_numpy()
+        order = np.argsort(~is_future, kind='stable')
+        holding, is_future = holding.iloc[order].reset_index(drop=True), is_future[order]
+        holding['udl'] = holding['udl'].mask(is_future, holding['variety'])
 
         # 拆分多空方向持仓
-        holding_long = holding[holding['多头持仓'] > 0].drop(columns=['空头持仓'])
-        holding_long['long_short'] = 'long'
-        holding_long.rename(columns={'多头持仓': 'quantity'}, inplace=True)
-        holding_long['code_dir'] = holding_long['code'] + '.L'
-        holding_short = holding[holding['空头持仓'] < 0].drop(columns=['多头持仓'])
-        holding_short['long_short'] = 'short'
-        holding_short.rename(columns={'空头持仓': 'quantity'}, inplace=True)
-        holding_short['quantity'] *= -1
-        holding_short['code_dir'] = holding_short['code'] + '.S'
-        dfs_to_concat = [df for df in [holding_long, holding_short] if not df.empty]
-        holding = pd.concat(dfs_to_concat, ignore_index=True)
+        columns = [col for col in holding.columns if col != '空头持仓']
+        columns[columns.index('多头持仓')] = 'quantity'
+        holding = holding.melt(
+            id_vars=holding.columns.drop(['多头持仓', '空头持仓']),
+            value_vars=['多头持仓', '空头持仓'], var_name='long_short', value_name='quantity')
+        is_long = (holding['long_short'] == '多头持仓').values
+        holding['long_short'] = np.where(is_long, 'long', 'short')
+        holding['quantity'] = np.where(is_long, holding['quantity'], -holding['quantity'])
+        holding = holding[holding['quantity'] > 0].reset_index(drop=True)
+        holding = holding[columns + ['long_short']]
+        holding['code_dir'] = holding['code'] + np.where(
+            holding['long_short'] == 'long', '.L', '.S')
 
         # 计算保证金
-        self.margin_ratio_df.rename(columns={'MarginRatio': 'margin_ratio'}, inplace=True)
-        holding = pd.merge(holding, self.margin_ratio_df,
-                           left_on='variety', right_index=True, how='left')
-        holding['margin'] = holding.apply(
-            lambda pos: MarginCalculator(pos).calc(), axis=1)
+        holding['margin_ratio'] = holding['variety'].map(self.margin_ratio)
+        holding['margin'] = MarginCalculator.calc_frame(holding)
         holding['total_margin'] = holding['margin'] * holding['quantity']
 
-        # 处理中金所、上期所单个账号持仓的单向大边保证金
-        dfs = []
-        for _, holding_account in holding.groupby('account'):
-            dfs.append(process_larger_side_margin(holding_account))
-        holding = pd.concat(dfs, ignore_index=True)
+        # 处理中金所、上期所各账号持仓的单向大边保证金
+        holding = process_larger_side_margin(holding)
+
+        # 低基数字符串列转为分类类型, 以加速后续的分组与比较
+        holding = holding.astype({col: 'category' for col in
+                                  ['exchange', 'type', 'variety', 'long_short', 'call_put']})
         return holding
 
-    def _merge_futures_data(self, holding_futures: pd.DataFrame) -> pd.DataFrame:
-        """补充期货持仓的市场数据"""
-        columns = ['future_code', 'last_tradedate', 'multiplier', 'close_price']
-        if self.stock_futures_data is None:
-            self.stock_futures_data = pd.DataFrame(columns=columns)
-        else:
-            self.stock_futures_data = self.stock_futures_data[columns]
-        if self.commodity_futures_data is None:
-            self.commodity_futures_data = pd.DataFrame(columns=columns)
-        else:
-            self.commodity_futures_data.rename(columns={'contract_unit': 'multiplier'},
-                                               inplace=True)
-            self.commodity_futures_data = self.commodity_futures_data[columns]
-        dfs_to_concat = [df for df in [self.stock_futures_data, self.commodity_futures_data]
-                         if not df.empty]
+    def _get_futures_data(self) -> pd.DataFrame:
+        """整理期货市场数据"""
+        columns = self.FUTURES_DATA_COLUMNS
+        dfs_to_concat = []
+        if self.stock_futures_data is not None:
+            dfs_to_concat.append(self.stock_futures_data[columns])
+        if self.commodity_futures_data is not None:
+            dfs_to_concat.append(self.commodity_futures_data.rename(
+                columns={'contract_unit': 'multiplier'})[columns])
+        if not dfs_to_concat:
+            return pd.DataFrame(columns=['code'] + columns[1:])
         futures_data = pd.concat(dfs_to_concat, ignore_index=True)
         futures_data.rename(columns={'future_code': 'code'}, inplace=True)
-        holding_futures = pd.merge(holding_futures, futures_data, on='code', how='left')
-        holding_futures['udl'] = holding_futures['variety']
-        return holding_futures
-
-    def _merge_options_data(self, holding_options: pd.DataFrame) -> pd.DataFrame:
-        """补充期权持仓的市场数据"""
-        columns = ['option_code', 'option_mark_code', 'last_tradedate', 'call_put',
-                   'strike_price', 'multiplier', 'close_price', 'udl_price',
-                   'delta', 'gamma']
-        if self.stock_options_data is None:
-            self.stock_options_data = pd.DataFrame(columns=columns)
-        else:
-            self.stock_options_data = self.stock_options_data[columns]
-        if self.commodity_options_data is None:
-            self.commodity_options_data = pd.DataFrame(columns=columns)
-        else:
-            self.commodity_options_data.rename(columns={'contract_unit': 'multiplier'},
-                                               inplace=True)
-            self.commodity_options_data = self.commodity_options_data[columns]
-        dfs_to_concat = [df for df in [self.stock_options_data, self.commodity_options_data]
-                         if not df.empty]
+        return futures_data
+
+    def _get_options_data(self) -> pd.DataFrame:
+        """整理期权市场数据"""
+        columns = self.OPTIONS_DATA_COLUMNS
+        dfs_to_concat = []
+        if self.stock_options_data is not None:
+            dfs_to_concat.append(self.stock_options_data[columns])
+        if self.commodity_options_data is not None:
+            dfs_to_concat.append(self.commodity_options_data.rename(
+                columns={'contract_unit': 'multiplier'})[columns])
+        if not dfs_to_concat:
+            return pd.DataFrame(columns=['code', 'udl'] + columns[2:])
         options_data = pd.concat(dfs_to_concat, ignore_index=True)
         options_data.rename(columns={'option_code': 'code', 'option_mark_code': 'udl'},
                             inplace=True)
-        holding_options = pd.merge(holding_options, options_data, on='code', how='left')
-        return holding_options
+        return options_data
 
 
 def parse_position_code(code: str) -> dict[str, str]:
@@ -158,28 +260,28 @@ def parse_position_code(code: str) -> dict[str, str]:
     variety = None
 
     if exchange == Exchange.CFFEX:
-        match_future = re.match(r'^(IF|IC|IM|IH)[0-9]{4}$', code)
+        match_future = _RE_CFFEX_FUTURE.match(code)
         if match_future:
             position_type = PositionType.Future
             variety = match_future.group(1)
         else:
-            match_option = re.match(r'^(IO|MO|HO)[0-9]{4}.', code)
+            match_option = _RE_CFFEX_OPTION.match(code)
             if match_option:
                 position_type = PositionType.Option
                 variety = match_option.group(1)
-    elif exchange in {Exchange.SSE, Exchange.SZSE}:
-        match_option1 = re.match(r'^[0-9]{8}$', code)
-        match_option2 = re.match(r'^[0-9]{6}(C|P|-C-|-P-).', code)
+    elif exchange in Exchange.ETFExchanges:
+        match_option1 = _RE_ETF_OPTION1.match(code)
+        match_option2 = _RE_ETF_OPTION2.match(code)
         if match_option1 or match_option2:
             position_type = PositionType.Option
             variety = 'ETF'
-    elif exchange in {Exchange.SHFE, Exchange.CZCE, Exchange.DCE, Exchange.GFEX}:
-        match_future = re.match(r'^([A-Za-z]+)[0-9]{4}$', code)
+    elif exchange in Exchange.CommodityExchanges:
+        match_future = _RE_COMMODITY_FUTURE.match(code)
         if match_future:
             position_type = PositionType.Future
             variety = match_future.group(1).upper()
         else:
-            match_option = re.match(r'^([A-Za-z]+)[0-9]{4}(C|P|-C-|-P-).', code)
+            match_option = _RE_COMMODITY_OPTION.match(code)
             if match_option:
                 position_type = PositionType.Option
                 variety = match_option.group(1).upper()
@@ -192,3 +294,61 @@ def parse_position_code(code: str) -> dict[str, str]:
         'type': position_type,
         'variety': variety
     }
+
+
+def parse_position_codes(codes: pd.Series) -> pd.DataFrame:
+    """
+    向量化解析一列持仓代码, 提取交易所、持仓类型和品种信息
+
+    Args:
+        codes (Series): 持仓代码
+
+    Returns:
+        DataFrame: 包含 exchange, type, variety 三列, 索引与 codes 一致
+    """
+    parts = codes.str.split('.', n=2, expand=True).reindex(columns=[0, 1, 2])
+    invalid = parts[1].isna() | parts[2].notna()    # 须恰好包含一个 '.'
+    if invalid.any():
+        raise ValueError(f'无法解析代码: {codes[invalid].iloc[0]}')
+    symbol, exchange_code = parts[0], parts[1]
+    exchange = exchange_code.map(
+        {code: Exchange.from_code(code) for code in exchange_code.unique()})
+
+    parsed = pd.DataFrame({'exchange': exchange, 'type': None, 'variety': None},
+                          index=codes.index)
+    is_cffex = (exchange == Exchange.CFFEX)
+    is_etf = exchange.isin(Exchange.ETFExchanges)
+    is_commodity = exchange.isin(Exchange.CommodityExchanges)
+
+    if is_cffex.any():
+        parsed.loc[is_cffex, ['type', 'variety']] = _extract_type_variety(
+            symbol[is_cffex], _RE_CFFEX_FUTURE, _RE_CFFEX_OPTION)
+    if is_etf.any():
+        symbol_etf = symbol[is_etf]
+        is_option = (symbol_etf.str.match(_RE_ETF_OPTION1) |
+                     symbol_etf.str.match(_RE_ETF_OPTION2))
+        parsed.loc[is_option[is_option].index, ['type', 'variety']] = [PositionType.Option, 'ETF']
+    if is_commodity.any():
+        type_variety = _extract_type_variety(
+            symbol[is_commodity], _RE_COMMODITY_FUTURE, _RE_COMMODITY_OPTION)
+        type_variety['variety'] = type_variety['variety'].str.upper()
+        parsed.loc[is_commodity, ['type', 'variety']] = type_variety
+
+    unparsed = parsed['type'].isna() | parsed['variety'].isna()
+    if unparsed.any():
+        raise ValueError(f'无法解析代码: {codes[unparsed].iloc[0]}')
+    return parsed
+
+
+def _extract_type_variety(symbol: pd.Series, future_pattern: re.Pattern,
+                          option_pattern: re.Pattern) -> pd.DataFrame:
+    """按期货、期权正则依次匹配代码, 返回持仓类型与品种 (期货优先)"""
+    future_variety = symbol.str.extract(future_pattern, expand=True)[0]
+    option_variety = symbol.str.extract(option_pattern, expand=True)[0]
+    is_future = future_variety.notna()
+    is_option = ~is_future & option_variety.notna()
+    return pd.DataFrame({
+        'type': np.select([is_future, is_option],
+                          [PositionType.Future, PositionType.Option], default=None),
+        'variety': future_variety.where(is_future, option_variety),
+    }, index=symbol.index)
@@ -19,11 +19,16 @@ def main():
     futures_data_csv = os.path.join(input_path, 'future_quote.csv')
     margin_account_excel = os.path.join(input_path, 'margin_account.xlsx')
     params_excel = os.path.join(input_path, 'marginCfg.xlsx')
-    holding = DataLoader.load_holding(holding_excel)
-    options_data = DataLoader.load_market_data(options_data_csv, encoding='GB2312')
-    futures_data = DataLoader.load_market_data(futures_data_csv, encoding='GB2312')
-    margin_account = DataLoader.load_account(margin_account_excel)
-    margin_ratio_df, supplement, cov, mu = DataLoader.load_params(params_excel)
+    holding = DataLoader.load_holding(holding_excel, cache_dir=temp_path)
+    options_data = DataLoader.load_market_data(
+        options_data_csv, encoding='GB2312', cache_dir=temp_path,
+        usecols=HoldingDataProcessor.OPTIONS_DATA_COLUMNS)
+    futures_data = DataLoader.load_market_data(
+        futures_data_csv, encoding='GB2312', cache_dir=temp_path,
+        usecols=HoldingDataProcessor.FUTURES_DATA_COLUMNS)
+    margin_account = DataLoader.load_account(margin_account_excel, cache_dir=temp_path)
+    margin_ratio_df, supplement, cov, mu = DataLoader.load_params(params_excel,
+                                                                  cache_dir=temp_path)
 
     processed_holding = HoldingDataProcessor(
         holding, margin_ratio_df,
@@ -1,58 +1,81 @@
-from typing import Optional
+import copy
+import os
+import warnings
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 import pandas as pd
-from scipy.optimize import milp, LinearConstraint
+from scipy.optimize import milp, Bounds, LinearConstraint
+from scipy.sparse import csc_matrix
+from scipy.sparse.csgraph import connected_components
 from base import Exchange, PositionType
-from strategy import StrategyAnalyzerFactory
+from strategy import StrategyBatchAnalyzer
 
 
 class MarginOptimizer:
+    # 每批分析的持仓头寸对数量上限, 控制批量分析时临时数组的内存占用
+    pair_chunk_size = 1 << 20
+    # 传给 HiGHS 的 MILP 求解参数; 默认不限时, 如需限时可加入 time_limit
+    milp_options = {'presolve': True, 'disp': False, 'mip_rel_gap': 1e-6}
+
     def __init__(self, holding: pd.DataFrame, is_close: bool):
         self.holding = holding
         self.is_close = is_close
 
-    def _analyze_strategy(self, anchor_pos: pd.Series, pos: pd.Series
-                          ) -> dict[str, Optional[str | float]]:
-        """分析两手持仓可构成的组合策略, 并计算其组合保证金"""
-        analysis = {
-            'type': None,
-            'margin': None,
-            'margin_saving': None,
-        }
-        analyzer = StrategyAnalyzerFactory.create(anchor_pos, pos, self.is_close)
-        strategy = analyzer.analyze()
-        if strategy:
-            analysis.update({
-                'type': strategy.type,
-                'margin': strategy.margin,
-                'margin_saving': strategy.margin_saving,
-            })
-        return analysis
-
     def _find_available_strategies(self, holding_account: pd.DataFrame) -> pd.DataFrame:
-        """寻找某个账号持仓的所有可行组合策略"""
-        holding_account = holding_account[
-            holding_account['type'].isin((PositionType.Future, PositionType.Option))
-        ].copy().reset_index(drop=True)
-        strats_dfs = []
+        """
+        寻找某个账号持仓的所有可行组合策略
 
-        for i, anchor_pos in holding_account.iterrows():
-            if i == len(holding_account) - 1:
-                break
-            temp = holding_account[i+1:].copy()
-            temp[['type', 'margin', 'margin_saving']] = temp.apply(
-                lambda pos: pd.Series(self._analyze_strategy(anchor_pos, pos).values()), axis=1
-            )
-            temp.dropna(subset=['type'], inplace=True)
-            temp = temp[temp['margin_saving'] > 0].copy()
-            if temp.empty:
-                continue
-            temp['code_dir'] = temp['code_dir'].apply(lambda x: (anchor_pos['code_dir'], x))
-            temp = temp[['code_dir', 'type', 'margin', 'margin_saving']]
-            strats_dfs.append(temp)
+        Args:
+            holding_account (DataFrame): 单个账号的持仓数据
+
+        Returns:
+            DataFrame: 可行组合策略, 其中 leg1, leg2 为两笔持仓头寸在 holding_account 中的行号
+        """
+        is_derivative = holding_account['type'].isin((PositionType.Future, PositionType.Option))
+        holding_account = holding_account[is_derivative]
+        columns = ['code_dir', 'code', 'type', 'exchange', 'variety', 'udl', 'long_short',
+                   'call_put', 'last_tradedate', 'strike_price', 'close_price',
+                   'multiplier', 'margin']
+        positions = {col: holding_account[col].to_numpy() for col in columns}
+        positions['row'] = np.flatnonzero(is_derivative)
+        strats_dfs = []
+        # 分批构造持仓头寸对 (i < j), 以数组运算批量分析
+        for idx1, idx2 in self._iter_pair_chunks(len(holding_account)):
+            pos1 = {col: values[idx1] for col, values in positions.items()}
+            pos2 = {col: values[idx2] for col, values in positions.items()}
+            types, margins = StrategyBatchAnalyzer.analyze(pos1, pos2, self.is_close)
+            margin_savings = pos1['margin'] + pos2['margin'] - margins
+            is_avail = (types != None) & (margin_savings > 0)    # noqa: E711
+            strats_dfs.append(pd.DataFrame({
+                'code_dir': list(zip(pos1['code_dir'][is_avail], pos2['code_dir'][is_avail])),
+                'type': types[is_avail],
+                'margin': margins[is_avail],
+                'margin_saving': margin_savings[is_avail],
+                'leg1': pos1['row'][is_avail],
+                'leg2': pos2['row'][is_avail],
+            }))
+        if not strats_dfs:
+            return pd.DataFrame(
+                columns=['code_dir', 'type', 'margin', 'margin_saving', 'leg1', 'leg2'])
         avail_strats = pd.concat(strats_dfs, ignore_index=True)
         return avail_strats
 
+    def _iter_pair_chunks(self, n_pos: int):
+        """
+        按锚点行分批生成持仓头寸对 (i < j) 的索引, 顺序与逐对遍历一致
+
+        Args:
+            n_pos (int): 持仓头寸数量
+
+        Yields:
+            tuple[ndarray, ndarray]: 一批持仓头寸对的两侧索引, 每批不超过 pair_chunk_size 对
+        """
+        n_anchor = max(1, self.pair_chunk_size // max(n_pos, 1))
+        for start in range(0, n_pos - 1, n_anchor):
+            anchors = np.arange(start, min(start + n_anchor, n_pos - 1))
+            idx1, idx2 = np.nonzero(anchors[:, None] < np.arange(n_pos))
+            yield anchors[idx1], idx2
+
     def _optimize(self, holding_account: pd.DataFrame) -> pd.DataFrame:
         """单个账号持仓的组合保证金优化"""
         exchange = holding_account['exchange'].iloc[0]
@@ -74,40 +97,112 @@ class MarginOptimizer:
         c = avail_strats['margin_saving'].values
         ub = holding_account['quantity'].values
         lb = np.zeros_like(ub)
-        A = np.zeros([len(holding_account), len(avail_strats)])
-        for j, (pos1, pos2) in enumerate(avail_strats['code_dir']):
-            i1 = holding_account.index[holding_account['code_dir'] == pos1][0]
-            i2 = holding_account.index[holding_account['code_dir'] == pos2][0]
-            A[i1, j] = 1
-            A[i2, j] = 1
-        constraints = LinearConstraint(A, lb, ub)
-        integrality = np.ones_like(c)
-        res = milp(c=-c, constraints=constraints, integrality=integrality)
-
-        if res.success:
-            selected_strats = avail_strats[['code_dir', 'type', 'margin']].copy()
-            selected_strats['quantity'] = res.x
-            selected_strats = selected_strats[selected_strats['quantity'] > 0].reset_index(drop=True)
-            remaining = holding_account[['code_dir', 'type', 'margin']].copy()
-            remaining['quantity'] = ub - A @ res.x
-            dfs_to_concat = [df for df in [remaining, selected_strats] if not df.empty]
-            optimum = pd.concat(dfs_to_concat, ignore_index=True)
-            optimum['total_margin'] = optimum['margin'] * optimum['quantity']
-            return optimum
+        # 每个组合恰好占用两笔持仓头寸, A 每列仅两个非零元素, 以稀疏矩阵存储
+        n_pos, n_strats = len(holding_account), len(avail_strats)
+        rows = np.empty(2 * n_strats, dtype=np.int64)
+        rows[0::2] = avail_strats['leg1'].to_numpy()
+        rows[1::2] = avail_strats['leg2'].to_numpy()
+        cols = np.repeat(np.arange(n_strats), 2)
+        A = csc_matrix((np.ones(2 * n_strats), (rows, cols)), shape=(n_pos, n_strats))
+        # HiGHS 返回的整数解可能带有浮点误差, 如 0.9999999
+        x = np.rint(self._solve_milp(c, A, lb, ub))
+
+        # 剩余持仓头寸在前, 选中的组合 (数量为正) 在后
+        is_selected = (x > 0)
+        quantity = np.concatenate([ub - A @ x, x[is_selected]])
+        margin = np.concatenate([holding_account['margin'].to_numpy(),
+                                 avail_strats['margin'].to_numpy()[is_selected]])
+        optimum = pd.DataFrame({
+            'code_dir': np.concatenate([holding_account['code_dir'].to_numpy(dtype=object),
+                                        avail_strats['code_dir'].to_numpy()[is_selected]]),
+            'type': np.concatenate([holding_account['type'].to_numpy(dtype=object),
+                                    avail_strats['type'].to_numpy()[is_selected]]),
+            'quantity': quantity,
+            'margin': margin,
+            'total_margin': margin * quantity,
+        })
+        return optimum
+
+    def _solve_milp(self, c: np.ndarray, A: csc_matrix, lb: np.ndarray,
+                    ub: np.ndarray) -> np.ndarray:
+        """
+        按连通分量分解并求解组合数量的 MILP
+
+        持仓头寸为节点、组合为边, 不同连通分量之间不共享约束, 可分别独立求解
+
+        Args:
+            c (ndarray): 各组合节省的保证金, shape: (n_strats,)
+            A (csc_matrix): 持仓数量约束矩阵, shape: (n_pos, n_strats)
+            lb (ndarray): 约束下界, shape: (n_pos,)
+            ub (ndarray): 约束上界, shape: (n_pos,)
+
+        Returns:
+            ndarray: 各组合的最优数量, shape: (n_strats,)
+        """
+        _, pos_labels = connected_components(A @ A.T, directed=False)
+        # 组合所属分量即其任一持仓头寸所属分量
+        legs = A.indices.reshape(-1, 2)
+        strat_labels = pos_labels[legs[:, 0]]
+        # 组合数量不超过其两笔持仓头寸数量的较小者
+        x_ub = ub[legs].min(axis=1)
+        labels, inverse, counts = np.unique(
+            strat_labels, return_inverse=True, return_counts=True)
+        # 仅含单个组合的分量无需求解: 节省为正时取满其数量上界
+        is_single = (counts[inverse] == 1)
+        x = np.where(is_single & (c > 0), x_ub, 0.0)
+        for label in labels[counts > 1]:
+            is_strat = (strat_labels == label)
+            is_pos = (pos_labels == label)
+            constraints = LinearConstraint(A[:, is_strat][is_pos], lb[is_pos], ub[is_pos])
+            res = milp(c=-c[is_strat], constraints=constraints,
+                       integrality=np.ones(is_strat.sum(), dtype=np.int8),
+                       bounds=Bounds(0, x_ub[is_strat]), options=self.milp_options)
+            if res.status == 1 and res.x is not None:
+                # 达到 time_limit 等求解上限时, 采用当前最优的可行解
+                warnings.warn(
+                    f'MILP stopped early, using the best feasible solution: {res.message}')
+            elif not res.success:
+                raise ValueError('Optimization failed.')
+            x[is_strat] = res.x
+        return x
+
+    def run(self, include_zero_quantities: bool = False, n_jobs: int = 1) -> pd.DataFrame:
+        """
+        对各账号持仓进行保证金优化
+
+        Args:
+            include_zero_quantities (bool): 是否保留数量为 0 的持仓与组合
+            n_jobs (int): 并行优化的进程数, 各账号之间相互独立; 为 1 时在当前进程中依次优化,
+                不大于 0 时取 CPU 核数
+
+        Returns:
+            DataFrame: 各账号优化后的持仓与组合
+        """
+        if n_jobs <= 0:
+            n_jobs = os.cpu_count() or 1
+        keys = []
+
+        def iter_holding_accounts():
+            # 逐个生成各账号持仓, 不同时保留全部账号的副本; 优化完成后即可释放
+            for key, holding_account in self.holding.groupby(['exchange', 'account'],
+                                                             observed=True):
+                keys.append(key)
+                yield holding_account.reset_index(drop=True)
+
+        if n_jobs == 1:
+            temp_dfs = list(map(self._optimize, iter_holding_accounts()))
         else:
-            raise ValueError('Optimization failed.')
-
-    def run(self, include_zero_quantities: bool = False) -> pd.DataFrame:
-        """对各账号持仓进行保证金优化"""
-        temp_dfs = []
-        groups = self.holding.groupby(['exchange', 'account'])
-        for (exchange, account), holding_account in groups:
-            holding_account.reset_index(drop=True, inplace=True)
-            optimum_account = self._optimize(holding_account)
-            optimum_account['exchange'] = exchange
-            optimum_account['account'] = account
-            temp_dfs.append(optimum_account)
+            # 子进程只需要优化参数, 不必传输全部持仓
+            worker = copy.copy(self)
+            worker.holding = None
+            with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+                temp_dfs = list(executor.map(worker._optimize, iter_holding_accounts()))
+        sizes = [len(df) for df in temp_dfs]
         optimum = pd.concat(temp_dfs, ignore_index=True)
+        # 交易所与账号列在合并后一次性赋值
+        exchanges, accounts = zip(*keys)
+        optimum['exchange'] = pd.Index(exchanges).repeat(sizes)
+        optimum['account'] = pd.Index(accounts).repeat(sizes)
         if not include_zero_quantities:
             optimum = optimum[optimum['quantity'] > 0].reset_index(drop=True)
         columns = ['exchange', 'account', 'code_dir', 'type', 'quantity', 'margin', 'total_margin']
@@ -1,6 +1,8 @@
+from functools import cached_property
 from typing import Optional
 import numpy as np
 import pandas as pd
+from scipy.linalg import cholesky
 from base import PositionType
 from margin_utils import MarginCalculator, calc_larger_side_margin_vec
 
@@ -13,25 +15,84 @@ class MarginStressTest:
         self.margin_account = margin_account
         self.target_risk_ratio = target_risk_ratio
 
+    def _group_holding(self) -> dict:
+        """一次性按账号划分持仓数据, 返回 账号 -> 该账号持仓"""
+        return dict(iter(self.holding.groupby('account', sort=False)))
+
     @staticmethod
     def calc_pnl_margin_r(pos: pd.Series, r: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
         """计算单笔持仓在一系列标的收益率下的盈亏和保证金"""
         quantity = pos['quantity']
-        quantity_dir = quantity * {'long': 1, 'short': -1}.get(pos['long_short'])
+        quantity_dir = quantity if pos['long_short'] == 'long' else -quantity
         margin_calculator = MarginCalculator(pos)
         if pos['type'] == PositionType.Future:
             price = pos['close_price'] * (1 + r)
             pnl = (price - pos['close_price']) * quantity_dir
-            margin = MarginCalculator(pos).calc_future_vec(price) * quantity
+            margin = margin_calculator.calc_future_vec(price) * quantity
         elif pos['type'] == PositionType.Option:
             s = pos['udl_price'] * (1 + r)
             price = (pos['close_price'] + (s - pos['udl_price']) * pos['delta']
-                        + 0.5 * (s - pos['udl_price'])**2 * pos['gamma'])    # delta-gamma近似
+                     + 0.5 * (s - pos['udl_price'])**2 * pos['gamma'])    # delta-gamma近似
             pnl = (price - pos['close_price']) * quantity_dir
-            calc_margin_vec = np.vectorize(margin_calculator.calc_option)
-            margin = MarginCalculator(pos).calc_option_vec(s, price) * quantity
+            margin = margin_calculator.calc_option_vec(s, price) * quantity
         return pnl, margin
 
+    @staticmethod
+    def calc_pnl_margin_positions(holding_account: pd.DataFrame, r_pos: np.ndarray
+                                  ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        计算各笔持仓在一系列标的收益率下的盈亏和保证金
+
+        数值精度与 r_pos 一致: 模拟路径为 float32 时, 逐笔盈亏与保证金也以 float32
+        计算以减半内存带宽, 相对误差约 1e-7, 远小于蒙特卡洛误差; 账号层面的汇总
+        仍以 float64 累加. 给定情景 (float64) 下的计算不受影响.
+
+        Args:
+            holding_account (DataFrame): 单个账号的持仓数据
+            r_pos (ndarray): 各笔持仓的标的收益率情形, shape: (n_pos, *scenarios_dim)
+
+        Returns:
+            tuple[ndarray, ndarray]: 盈亏与保证金, shape: (n_pos, *scenarios_dim);
+                精度与 r_pos 一致 (至少 float32)
+        """
+        # 持仓字段一次性取为数组, 并扩展维度以便与情形维广播
+        expand = (slice(None),) + (None,) * (r_pos.ndim - 1)
+        # 数值计算沿用收益率情形的精度
+        float_dtype = np.result_type(r_pos.dtype, np.float32)
+
+        def col(name: str) -> np.ndarray:
+            return holding_account[name].to_numpy(dtype=float_dtype)[expand]
+
+        position_type, exchange, long_short, call_put = (
+            holding_account[name].to_numpy(dtype=object)
+            for name in ['type', 'exchange', 'long_short', 'call_put'])
+        quantity, close_price, udl_price, multiplier, margin_ratio = (
+            col(name) for name in
+            ['quantity', 'close_price', 'udl_price', 'multiplier', 'margin_ratio'])
+        quantity_dir = np.where(long_short[expand] == 'long', quantity, -quantity)
+
+        pnls = np.full(r_pos.shape, np.nan, dtype=float_dtype)
+        margins = np.full(r_pos.shape, np.nan, dtype=float_dtype)
+        # 期货与期权分别取出连续的收益率子张量, 各自只计算适用的公式
+        fut = np.flatnonzero(position_type == PositionType.Future)
+        if len(fut):
+            price = close_price[fut] * (1 + r_pos[fut])
+            pnls[fut] = (price - close_price[fut]) * quantity_dir[fut]
+            margins[fut] = MarginCalculator.calc_future_batch(
+                price, multiplier[fut], margin_ratio[fut]) * quantity[fut]
+        opt = np.flatnonzero(position_type == PositionType.Option)
+        if len(opt):
+            s = udl_price[opt] * (1 + r_pos[opt])
+            ds = s - udl_price[opt]
+            price = (close_price[opt] + ds * col('delta')[opt]
+                     + 0.5 * ds**2 * col('gamma')[opt])    # delta-gamma近似
+            pnls[opt] = (price - close_price[opt]) * quantity_dir[opt]
+            margins[opt] = MarginCalculator.calc_option_batch(
+                exchange[opt], long_short[opt], call_put[opt],
+                price, s, col('strike_price')[opt],
+                multiplier[opt], margin_ratio[opt]) * quantity[opt]
+        return pnls, margins
+
 
 class MarginStressVaR(MarginStressTest):
     def __init__(self, holding: pd.DataFrame,
@@ -57,37 +118,45 @@ class MarginStressVaR(MarginStressTest):
         self.dt = dt
         self.n_step = n_step
 
-    def _get_cov_cholesky(self) -> tuple[np.ndarray, np.ndarray]:
-        """Cholesky分解协方差矩阵, 返回L矩阵和波动率向量"""
-        n_udl = len(self.cov)
-        vol_vec = np.diag(self.cov)
-        corr = self.cov - np.diag(np.diag(self.cov)) + np.eye(n_udl)
-        cov_matrix = corr * np.outer(vol_vec, vol_vec)
-        L = np.linalg.cholesky(cov_matrix)
+    def refresh(self):
+        """修改 cov 后调用, 使缓存的 Cholesky 分解失效"""
+        self.__dict__.pop('_cov_cholesky', None)
+
+    @cached_property
+    def _cov_cholesky(self) -> tuple[np.ndarray, np.ndarray]:
+        """Cholesky分解协方差矩阵, 返回L矩阵和波动率向量 (首次访问时计算并缓存)"""
+        vol_vec = np.diag(self.cov).copy()
+        # 非对角线: 相关系数 * 波动率乘积; 对角线: 方差
+        cov_matrix = self.cov * np.outer(vol_vec, vol_vec)
+        np.fill_diagonal(cov_matrix, vol_vec**2)
+        L = cholesky(cov_matrix, lower=True, check_finite=False)
         return L, vol_vec
 
     def gen_path(self, n_path: int = 10000, seed: Optional[int] = None) -> np.ndarray:
-        """生成标的收益率路径, shape: (n_step, n_udl, n_path)"""
-        L, vol_vec = self._get_cov_cholesky()
+        """生成标的收益率路径 (float32), shape: (n_step, n_udl, n_path)"""
+        L, vol_vec = self._cov_cholesky
         n_udl = len(vol_vec)
-        r_path = np.empty((self.n_step, n_udl, n_path))
-        if seed is not None:
-            np.random.seed(seed)
-        Z = np.random.standard_normal((self.n_step, n_udl, n_path))
-        log_r_path = ((self.mu[None, :, None] - 0.5 * vol_vec[None, :, None]**2) * self.dt
-                      + L @ Z * np.sqrt(self.dt))
+        # Cholesky 分解保持 float64, 路径以 float32 生成: 模拟误差远大于单精度舍入误差
+        L_dt = (L * np.sqrt(self.dt)).astype(np.float32)
+        drift = ((self.mu - 0.5 * vol_vec**2) * self.dt).astype(np.float32)
+        rng = np.random.default_rng(seed)
+        # 各步各路径的正态变量合并为一个矩阵, 一次矩阵乘法完成相关化
+        Z = rng.standard_normal((n_udl, self.n_step * n_path), dtype=np.float32)
+        log_r_path = (L_dt @ Z).reshape(n_udl, self.n_step, n_path).transpose(1, 0, 2)
+        log_r_path += drift[None, :, None]
         log_r_path = log_r_path.cumsum(axis=0)
-        r_path = np.exp(log_r_path) - 1
+        r_path = np.expm1(log_r_path)
         return r_path
 
     def _calc_path(self, r_path: np.ndarray, holding_account: pd.DataFrame
                    ) -> tuple[np.ndarray, np.ndarray]:
         """计算单个持仓账户在各标的收益率路径下的持仓盈亏与保证金, shape: (n_step, n_path)"""
-        pnls_pos, margins_pos = zip(*holding_account.apply(
-            lambda pos: self.calc_pnl_margin_r(
-                pos, r_path[:, self.udl_idx_map[pos['udl']], :]), axis=1))
-        pnl = np.sum(pnls_pos, axis=0)
-        margins_pos = np.array(margins_pos)
+        udl_idx = holding_account['udl'].map(self.udl_idx_map).to_numpy()
+        # 一次性取出各笔持仓的标的收益率路径, shape: (n_pos, n_step, n_path)
+        r_pos = r_path[:, udl_idx, :].transpose(1, 0, 2)
+        pnls_pos, margins_pos = self.calc_pnl_margin_positions(holding_account, r_pos)
+        # 逐笔结果为 float32, 账号汇总以 float64 累加
+        pnl = np.sum(pnls_pos, axis=0, dtype=np.float64)
         margin = calc_larger_side_margin_vec(holding_account, margins_pos)
         return pnl, margin
 
@@ -95,8 +164,8 @@ class MarginStressVaR(MarginStressTest):
                              supplement: pd.Series, equity: float | int) -> np.ndarray:
         """计算单个持仓账户通过模拟得到的风险度VaR, shape: (n_step,)"""
         pnl, margin = self._calc_path(r_path, holding_account)
-        equity = np.full_like(pnl, fill_value=equity)
-        equity += pnl + supplement.values.cumsum()[:, None]
+        # 期初权益与累计入金仅随步数变化, 先合并为 (n_step,) 向量再与路径盈亏相加
+        equity = pnl + (equity + supplement.to_numpy().cumsum())[:, None]
         risk_ratio = margin / equity
         risk_ratio_VaR = np.percentile(risk_ratio, self.VaR_percentile, axis=1)
         return risk_ratio_VaR
@@ -104,20 +173,18 @@ class MarginStressVaR(MarginStressTest):
     def run(self, n_path: int = 10000, seed: Optional[int] = None) -> pd.DataFrame:
         """通过模拟, 计算各持仓账户的风险度VaR"""
         columns = ['Account'] + [f'T+{i}' for i in range(self.n_step)] + ['Increasement']
-        VaR_df = pd.DataFrame(columns=columns)
-        r_path = self._gen_path(n_path, seed)
-        for account, account_info in self.margin_account.iterrows():
-            equity = account_info['equity']
-            holding_account = self.holding[self.holding['account'] == account].copy()
-            holding_account.reset_index(drop=True, inplace=True)
-            if holding_account.empty:
+        rows = []
+        r_path = self.gen_path(n_path, seed)
+        holding_groups = self._group_holding()
+        for account, equity in self.margin_account['equity'].items():
+            holding_account = holding_groups.get(account)
+            if holding_account is None:
                 continue
             remaining = max(sum(holding_account['total_margin']) - equity, 0)
             supplement = self.supplement.loc[account]
-            risk_ratio_VaR = self._calc_risk_ratio_VaR(r_path, holding_account, supplement, equity)
-            VaR_df.loc[len(VaR_df)] = [account, *risk_ratio_VaR, remaining]
-        VaR_df.dropna(inplace=True)
-        VaR_df.set_index('Account', inplace=True)
+            risk_ratio_VaR = self.calc_risk_ratio_VaR(r_path, holding_account, supplement, equity)
+            rows.append((account, *risk_ratio_VaR, remaining))
+        VaR_df = pd.DataFrame(rows, columns=columns).dropna().set_index('Account')
         return VaR_df
 
 
@@ -132,10 +199,9 @@ class MarginScenarioAnalysis(MarginStressTest):
     def _calc_udl_return_scenarios(self, holding_account: pd.DataFrame
                                    ) -> tuple[np.ndarray, np.ndarray]:
         """计算单个持仓账户在一系列标的收益率情景下的持仓盈亏与保证金"""
-        pnls_pos, margins_pos = zip(*holding_account.apply(
-            lambda pos: self.calc_pnl_margin_r(pos, self.scenarios_r), axis=1))
+        r_pos = np.broadcast_to(self.scenarios_r, (len(holding_account), len(self.scenarios_r)))
+        pnls_pos, margins_pos = self.calc_pnl_margin_positions(holding_account, r_pos)
         pnl = np.sum(pnls_pos, axis=0)
-        margins_pos = np.array(margins_pos)
         margin = calc_larger_side_margin_vec(holding_account, margins_pos)
         return pnl, margin
 
@@ -149,25 +215,36 @@ class MarginScenarioAnalysis(MarginStressTest):
         supplement = np.maximum(margin/self.target_risk_ratio - equity, 0)
         return risk_ratio, supplement
 
+    def pivot_scenarios(self, accounts: list, values: list[np.ndarray]) -> pd.DataFrame:
+        """
+        将各账户的情景结果组装为透视表
+
+        Args:
+            accounts (list): 账户列表
+            values (list[ndarray]): 各账户在各情景下的结果, 每项 shape: (n_scenarios,)
+
+        Returns:
+            DataFrame: 行为账户 (Account), 列为标的收益率情景 (r), 均按升序排列
+        """
+        pivot = pd.DataFrame(np.reshape(values, (len(accounts), len(self.scenarios_r))),
+                             index=pd.Index(accounts, name='Account'),
+                             columns=pd.Index(self.scenarios_r, name='r'))
+        return pivot.sort_index().sort_index(axis=1)
+
     def run(self) -> tuple[pd.DataFrame, pd.DataFrame]:
         """在一系列标的收益率情景下, 分析各持仓账户的风险度与入金"""
-        temp_dfs = []
-        for account, account_info in self.margin_account.iterrows():
-            equity = account_info['equity']
-            holding_account = self.holding[self.holding['account'] == account].copy()
-            holding_account.reset_index(drop=True, inplace=True)
-            if holding_account.empty:
+        accounts, risk_ratios, supplements = [], [], []
+        holding_groups = self._group_holding()
+        for account, equity in self.margin_account['equity'].items():
+            holding_account = holding_groups.get(account)
+            if holding_account is None:
                 continue
-            risk_ratio, supplement = self._calc_risk_ratio_supplement(holding_account, equity)
-            temp_dfs.append(pd.DataFrame({
-                'Account': account,
-                'r': self.scenarios_r,
-                'RiskRatio': risk_ratio,
-                'Supplement': supplement
-            }))
-        scenario_df = pd.concat(temp_dfs, ignore_index=True)
-        pivot_risk_ratio = scenario_df.pivot(index='Account', columns='r', values='RiskRatio')
-        pivot_supplement = scenario_df.pivot(index='Account', columns='r', values='Supplement')
+            risk_ratio, supplement = self.calc_risk_ratio_supplement(holding_account, equity)
+            accounts.append(account)
+            risk_ratios.append(risk_ratio)
+            supplements.append(supplement)
+        pivot_risk_ratio = self.pivot_scenarios(accounts, risk_ratios)
+        pivot_supplement = self.pivot_scenarios(accounts, supplements)
         return pivot_risk_ratio, pivot_supplement
 
 
@@ -195,32 +272,26 @@ class MarginStressTestCombined(MarginStressTest):
             ) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
         """计算各持仓账户的风险度VaR, 以及在一系列情景下的风险度与入金"""
         columns = ['Account'] + [f'T+{i}' for i in range(self.msv.n_step)] + ['Increasement']
-        VaR_df = pd.DataFrame(columns=columns)
-        temp_dfs = []
+        rows = []
+        accounts, risk_ratios, supplements = [], [], []
         r_path = self.msv.gen_path(n_path, seed)
 
-        for account, account_info in self.margin_account.iterrows():
-            equity = account_info['equity']
-            holding_account = self.holding[self.holding['account'] == account].copy()
-            holding_account.reset_index(drop=True, inplace=True)
-            if holding_account.empty:
+        holding_groups = self._group_holding()
+        for account, equity in self.margin_account['equity'].items():
+            holding_account = holding_groups.get(account)
+            if holding_account is None:
                 continue
             # VaR
             remaining = max(sum(holding_account['total_margin']) - equity, 0)
             supplement = self.msv.supplement.loc[account]
             risk_ratio_VaR = self.msv.calc_risk_ratio_VaR(r_path, holding_account, supplement, equity)
-            VaR_df.loc[len(VaR_df)] = [account, *risk_ratio_VaR, remaining]
+            rows.append((account, *risk_ratio_VaR, remaining))
             # Scenario
             risk_ratio, supplement = self.msa.calc_risk_ratio_supplement(holding_account, equity)
-            temp_dfs.append(pd.DataFrame({
-                'Account': account,
-                'r': self.msa.scenarios_r,
-                'RiskRatio': risk_ratio,
-                'Supplement': supplement
-            }))
-        VaR_df.dropna(inplace=True)
-        VaR_df.set_index('Account', inplace=True)
-        scenario_df = pd.concat(temp_dfs, ignore_index=True)
-        pivot_risk_ratio = scenario_df.pivot(index='Account', columns='r', values='RiskRatio')
-        pivot_supplement = scenario_df.pivot(index='Account', columns='r', values='Supplement')
+            accounts.append(account)
+            risk_ratios.append(risk_ratio)
+            supplements.append(supplement)
+        VaR_df = pd.DataFrame(rows, columns=columns).dropna().set_index('Account')
+        pivot_risk_ratio = self.msa.pivot_scenarios(accounts, risk_ratios)
+        pivot_supplement = self.msa.pivot_scenarios(accounts, supplements)
         return VaR_df, pivot_risk_ratio, pivot_supplement
@@ -5,8 +5,7 @@ from base import PositionType, Exchange
 
 class MarginCalculator:
     def __init__(self, pos: pd.Series):
-        for key, value in pos.dropna().items():
-            setattr(self, key, value)
+        self.__dict__.update(pos.dropna().to_dict())
 
     def calc(self, **kwargs) -> float:
         if self.type == PositionType.Future:
@@ -48,7 +47,7 @@ class MarginCalculator:
         elif self.call_put == 'put':
             otm = max(self.udl_price - self.strike_price, 0)
 
-        if self.exchange in {Exchange.SSE, Exchange.SZSE}:
+        if self.exchange in Exchange.ETFExchanges:
             if self.call_put == 'call':
                 return self.multiplier * (self.close_price + max(
                     0.12 * self.udl_price - otm,
@@ -76,6 +75,85 @@ class MarginCalculator:
             return self.multiplier * (
                 self.close_price + udl_margin - 0.5 * min(otm, udl_margin))
 
+    @staticmethod
+    def calc_frame(holding: pd.DataFrame) -> np.ndarray:
+        """
+        批量计算各笔持仓的保证金, 结果与逐行调用 calc 一致
+
+        Args:
+            holding (DataFrame): 持仓数据, 需已合并市场数据与保证金比例 margin_ratio
+
+        Returns:
+            ndarray: 各笔持仓的保证金金额, 非期货期权持仓为 NaN, shape: (n_pos,)
+        """
+        position_type = holding['type'].to_numpy(dtype=object)
+        margin = np.full(len(holding), np.nan)
+        fut = np.flatnonzero(position_type == PositionType.Future)
+        opt = np.flatnonzero(position_type == PositionType.Option)
+
+        def col(name: str, rows: np.ndarray, dtype=float) -> np.ndarray:
+            return holding[name].to_numpy(dtype=dtype)[rows]
+
+        if len(fut):
+            margin[fut] = MarginCalculator.calc_future_batch(
+                col('close_price', fut), col('multiplier', fut), col('margin_ratio', fut))
+        if len(opt):
+            margin[opt] = MarginCalculator.calc_option_batch(
+                col('exchange', opt, object), col('long_short', opt, object),
+                col('call_put', opt, object), col('close_price', opt), col('udl_price', opt),
+                col('strike_price', opt), col('multiplier', opt), col('margin_ratio', opt))
+        return margin
+
+    @staticmethod
+    def calc_future_batch(close_price: np.ndarray, multiplier: np.ndarray,
+                          margin_ratio: np.ndarray) -> np.ndarray:
+        """calc_future 的数组版本, 各参数按 numpy 规则广播"""
+        return close_price * multiplier * margin_ratio
+
+    @staticmethod
+    def calc_option_batch(exchange: np.ndarray, long_short: np.ndarray, call_put: np.ndarray,
+                          close_price: np.ndarray, udl_price: np.ndarray,
+                          strike_price: np.ndarray, multiplier: np.ndarray,
+                          margin_ratio: np.ndarray) -> np.ndarray:
+        """
+        calc_option 的数组版本: 按公式类别取出各自的空头持仓行, 每个公式只在其适用的行上求值
+
+        Args:
+            exchange (ndarray): 各笔期权持仓的交易所, shape: (n_pos,)
+            long_short (ndarray): 多空方向, shape: (n_pos,)
+            call_put (ndarray): 看涨看跌, shape: (n_pos,)
+            close_price, udl_price, strike_price, multiplier, margin_ratio (ndarray):
+                期权价格、标的价格、行权价、合约乘数与保证金比例, 首轴为持仓,
+                其余各轴 (情形维) 按 numpy 规则广播, shape: (n_pos, *scenarios_dim)
+
+        Returns:
+            ndarray: 各笔持仓在各情形下的保证金金额, 多头为 0, shape: (n_pos, *scenarios_dim)
+        """
+        values = (close_price, udl_price, strike_price, multiplier, margin_ratio)
+        n_pos = len(exchange)
+        if any(np.ndim(value) == 0 or len(value) != n_pos for value in values):
+            raise ValueError(f'Option inputs must have a leading axis of length {n_pos}.')
+        shape = np.broadcast_shapes(*(np.shape(value) for value in values))
+        is_call = (call_put == 'call')
+        is_etf = np.isin(exchange, list(Exchange.ETFExchanges))
+        # 公式类别, 多头不收取保证金记为 -1
+        kind = np.select([long_short == 'long', is_etf & is_call, is_etf,
+                          exchange == Exchange.CFFEX], [-1, 0, 1, 2], 3)
+        expand = (slice(None),) + (None,) * (len(shape) - 1)
+        margin = np.zeros(shape, dtype=np.result_type(*values))
+        for k, formula in enumerate(_OPTION_MARGIN_FORMULAS):
+            rows = np.flatnonzero(kind == k)
+            if len(rows) == 0:
+                continue
+            close_price_k, udl_price_k, strike_price_k, multiplier_k, margin_ratio_k = (
+                value[rows] for value in values)
+            is_call_k = is_call[rows][expand]
+            otm = np.where(is_call_k, np.maximum(strike_price_k - udl_price_k, 0),
+                           np.maximum(udl_price_k - strike_price_k, 0))
+            margin[rows] = multiplier_k * formula(
+                is_call_k, otm, close_price_k, udl_price_k, strike_price_k, margin_ratio_k)
+        return margin
+
     def calc_future_vec(self, close_price_vec: np.ndarray) -> np.ndarray:
         """
         给定期货价格情形, 计算期货持仓保证金 (支持向量化计算)
@@ -86,8 +164,8 @@ class MarginCalculator:
         Returns:
             ndarray: 各情形下的保证金金额, shape: (*scenarios_dim)
         """
-        calc_vec = np.vectorize(lambda p: self.calc_future(close_price=p))
-        return calc_vec(close_price_vec)
+        return self.calc_future_batch(
+            np.asarray(close_price_vec, dtype=float), self.multiplier, self.margin_ratio)
 
     def calc_option_vec(self, udl_price_vec: np.ndarray,
                         close_price_vec: np.ndarray) -> np.ndarray:
@@ -101,39 +179,88 @@ class MarginCalculator:
         Returns:
             ndarray: 各情形下的保证金金额, shape: (*scenarios_dim)
         """
-        calc_vec = np.vectorize(lambda s, p: self.calc_option(udl_price=s, close_price=p))
-        return calc_vec(udl_price_vec, close_price_vec)
+        # 以单笔持仓 (n_pos=1) 调用批量版本; 保证金比例为空时 (如 ETF 期权) 不会计入属性,
+        # 此时对应公式不使用该值
+        def pos(value) -> np.ndarray:
+            return np.asarray(value, dtype=float)[None]
 
+        return self.calc_option_batch(
+            np.array([self.exchange]), np.array([self.long_short]), np.array([self.call_put]),
+            pos(close_price_vec), pos(udl_price_vec), pos(self.strike_price),
+            pos(self.multiplier), pos(getattr(self, 'margin_ratio', np.nan)))[0]
 
-def process_larger_side_margin(holding_account: pd.DataFrame) -> pd.DataFrame:
-    """处理中金所、上期所单个账号持仓的单向大边保证金"""
-    exchange = holding_account['exchange'].iloc[0]
-    if exchange not in {Exchange.CFFEX, Exchange.SHFE}:
-        return holding_account
 
-    holding_futures = holding_account[holding_account['type'] == PositionType.Future]
-    if holding_futures.empty:
-        return holding_account
+def _etf_call_margin(is_call, otm, close_price, udl_price, strike_price, margin_ratio):
+    """上交所、深交所看涨期权单位保证金"""
+    return close_price + np.maximum(0.12 * udl_price - otm, 0.07 * udl_price)
 
-    if exchange == Exchange.CFFEX:
-        # CFFEX: 期货对锁、跨期、跨品种
-        larger_side = holding_futures.groupby('long_short')['total_margin'].sum().idxmax()
-        mask = (
-            (holding_account['type'] == PositionType.Future) &
-            (holding_account['long_short'] != larger_side)
-        )
-        holding_account.loc[mask, ['margin', 'total_margin']] = 0
-    else:
-        # SHFE: 期货对锁、跨期
-        for variety, holding_variety in holding_futures.groupby('variety'):
-            larger_side = holding_variety.groupby('long_short')['total_margin'].sum().idxmax()
-            mask = (
-                (holding_account['type'] == PositionType.Future) &
-                (holding_account['variety'] == variety) &
-                (holding_account['long_short'] != larger_side)
-            )
-            holding_account.loc[mask, ['margin', 'total_margin']] = 0
-    return holding_account
+
+def _etf_put_margin(is_call, otm, close_price, udl_price, strike_price, margin_ratio):
+    """上交所、深交所看跌期权单位保证金"""
+    return np.minimum(
+        close_price + np.maximum(0.12 * udl_price - otm, 0.07 * strike_price),
+        strike_price)
+
+
+def _cffex_option_margin(is_call, otm, close_price, udl_price, strike_price, margin_ratio):
+    """中金所期权单位保证金"""
+    min_safety_factor = 0.5
+    return close_price + np.maximum(
+        udl_price * margin_ratio - otm,
+        min_safety_factor * np.where(is_call, udl_price, strike_price) * margin_ratio)
+
+
+def _commodity_option_margin(is_call, otm, close_price, udl_price, strike_price, margin_ratio):
+    """商品期权单位保证金"""
+    udl_margin = udl_price * margin_ratio
+    return close_price + udl_margin - 0.5 * np.minimum(otm, udl_margin)
+
+
+# 按期权类别编号 (0: ETF 看涨, 1: ETF 看跌, 2: 中金所, 3: 商品) 索引的单位保证金公式
+_OPTION_MARGIN_FORMULAS = (
+    _etf_call_margin, _etf_put_margin, _cffex_option_margin, _commodity_option_margin)
+
+
+def process_larger_side_margin(holding: pd.DataFrame) -> pd.DataFrame:
+    """
+    处理中金所、上期所各账号持仓的单向大边保证金
+
+    Args:
+        holding (DataFrame): 全部账号的持仓数据, 需含 total_margin
+
+    Returns:
+        DataFrame: 小边期货头寸的保证金置零后的持仓数据, 按账号排列
+    """
+    holding = holding.sort_values('account', kind='stable', ignore_index=True)
+    # 账号所属交易所以其首笔持仓为准
+    exchange = holding.groupby('account', sort=False)['exchange'].transform('first')
+    is_future = (holding['type'] == PositionType.Future)
+    is_cffex = is_future & (exchange == Exchange.CFFEX)
+    is_shfe = is_future & (exchange == Exchange.SHFE)
+    if not (is_cffex.any() or is_shfe.any()):
+        return holding
+
+    # CFFEX: 期货对锁、跨期、跨品种, 按账号比较多空两边
+    # SHFE: 期货对锁、跨期, 按账号与品种比较多空两边
+    holding_futures = holding[is_cffex | is_shfe]
+    keys = [holding_futures['account'], holding_futures['variety'].where(is_shfe, '')]
+    group_codes = holding_futures.groupby(keys, sort=False, observed=True).ngroup().to_numpy()
+    is_long = (holding_futures['long_short'] == 'long').to_numpy()
+    # 与 groupby sum 一致, 缺失的保证金按 0 计
+    total_margin = holding_futures['total_margin'].fillna(0).to_numpy()
+    # 一次扫描按组累计多空两边的持仓数与保证金
+    n_group = group_codes.max() + 1
+    n_long = np.bincount(group_codes, weights=is_long, minlength=n_group)
+    n_short = np.bincount(group_codes, weights=~is_long, minlength=n_group)
+    margin_long = np.bincount(
+        group_codes, weights=np.where(is_long, total_margin, 0), minlength=n_group)
+    margin_short = np.bincount(
+        group_codes, weights=np.where(is_long, 0, total_margin), minlength=n_group)
+    # 与 groupby(...).sum().idxmax() 一致: 两边相等时取多头
+    larger_is_long = (n_long > 0) & ((n_short == 0) | (margin_long >= margin_short))
+    smaller_side = holding_futures.index[is_long != larger_is_long[group_codes]]
+    holding.loc[smaller_side, ['margin', 'total_margin']] = 0
+    return holding
 
 
 def calc_larger_side_margin_vec(holding_account: pd.DataFrame,
@@ -146,34 +273,30 @@ def calc_larger_side_margin_vec(holding_account: pd.DataFrame,
         margins (ndarray): 头寸保证金情形, shape: (n_pos, *scenarios_dim)
 
     Returns:
-        ndarray: 账号持仓总保证金, shape: (*scenarios_dim)
+        ndarray: 账号持仓总保证金, shape: (*scenarios_dim); 以 float64 汇总
     """
-    total_margin = margins.sum(axis=0)
-    exchange = holding_account['exchange'].iloc[0]
+    total_margin = margins.sum(axis=0, dtype=np.float64)
+    exchange = holding_account['exchange'].iat[0]
     if exchange not in {Exchange.CFFEX, Exchange.SHFE}:
         return total_margin
 
-    is_future = (holding_account['type'] == PositionType.Future)
+    is_future = (holding_account['type'].to_numpy() == PositionType.Future)
     if not is_future.any():
         return total_margin
 
-    holding_futures = holding_account[is_future]
-    margins_futures = margins[is_future.values]
     if exchange == Exchange.CFFEX:
-        # CFFEX: 期货对锁、跨期、跨品种
-        is_long = (holding_futures['long_short'] == 'long')
-        margin_long = margins_futures[is_long.values].sum(axis=0)
-        margin_short = margins_futures[~is_long.values].sum(axis=0)
-        smaller_side_margin = np.minimum(margin_long, margin_short)
+        # CFFEX: 期货对锁、跨期、跨品种, 全部期货头寸为一组
+        group_codes = np.zeros(len(holding_account), dtype=np.intp)
     else:
-        # SHFE: 期货对锁、跨期
-        smaller_side_margin = np.zeros_like(total_margin)
-        for variety in holding_futures['variety'].unique():
-            is_variety = (holding_futures['variety'] == variety)
-            holding_variety = holding_futures[is_variety]
-            margins_variety = margins_futures[is_variety.values]
-            is_long = (holding_variety['long_short'] == 'long')
-            margin_long = margins_variety[is_long.values].sum(axis=0)
-            margin_short = margins_variety[~is_long.values].sum(axis=0)
-            smaller_side_margin += np.minimum(margin_long, margin_short)
+        # SHFE: 期货对锁、跨期, 按品种分组
+        group_codes = pd.factorize(holding_account['variety'])[0]
+    group_codes = np.where(is_future, group_codes, -1)
+    is_long = (holding_account['long_short'] == 'long').to_numpy()
+    # 以 分组 x 多空 的指示矩阵与保证金情形相乘, 一次性汇总各组多空两边, 无需复制期货头寸的保证金
+    in_group = (group_codes == np.arange(group_codes.max() + 1)[:, None])    # (n_group, n_pos)
+    margins_flat = margins.reshape(len(margins), -1)
+    margin_long = (in_group & is_long).astype(margins_flat.dtype) @ margins_flat
+    margin_short = (in_group & ~is_long).astype(margins_flat.dtype) @ margins_flat
+    smaller_side_margin = np.minimum(margin_long, margin_short).sum(axis=0).reshape(
+        total_margin.shape)
     return total_margin - smaller_side_margin
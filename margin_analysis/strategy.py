@@ -1,24 +1,131 @@
 from abc import ABC, abstractmethod
 from functools import cached_property
+from typing import Any, Mapping
+import numpy as np
 import pandas as pd
 from base import Exchange, PositionType, Variety
 
 
+# 单笔持仓头寸: 持仓 DataFrame 的一行记录 (dict 或 Series), 以列名取值
+Position = Mapping[str, Any]
+# 一组持仓头寸: 列名到数组的映射, 各数组 shape: (n_pair,)
+Positions = Mapping[str, np.ndarray]
+
+
+# 组合策略适用的交易所
+_EX_DCE = frozenset({Exchange.DCE})
+_EX_SSE_SZSE = frozenset({Exchange.SSE, Exchange.SZSE})
+_EX_DCE_GFEX = frozenset({Exchange.DCE, Exchange.GFEX})
+_EX_CZCE_DCE = frozenset({Exchange.CZCE, Exchange.DCE})
+_EX_CZCE_DCE_GFEX = frozenset({Exchange.CZCE, Exchange.DCE, Exchange.GFEX})
+_EX_SSE_SZSE_DCE_GFEX = frozenset({Exchange.SSE, Exchange.SZSE, Exchange.DCE, Exchange.GFEX})
+_EX_SSE_SZSE_CZCE_DCE_GFEX = frozenset(
+    {Exchange.SSE, Exchange.SZSE, Exchange.CZCE, Exchange.DCE, Exchange.GFEX})
+
+
+def _take(positions: Positions, idx: np.ndarray) -> dict[str, np.ndarray]:
+    """按索引或布尔掩码选取一组持仓头寸"""
+    return {key: value[idx] for key, value in positions.items()}
+
+
+class _SinglePositions(dict):
+    """单笔持仓头寸的单元素数组形式: 组合规则读取某字段时才转为数组并缓存"""
+    def __init__(self, pos: Position):
+        super().__init__()
+        self._record = dict(pos.items())    # Series 逐列取值较慢, 先整体转为 dict
+
+    def __missing__(self, key: str) -> np.ndarray:
+        value = self[key] = np.array([self._record[key]])
+        return value
+
+
+def _swap(pos1: Positions, pos2: Positions, mask: np.ndarray
+          ) -> tuple[dict[str, np.ndarray], dict[str, np.ndarray]]:
+    """交换 mask 为 True 处的两组持仓头寸"""
+    return (
+        {key: np.where(mask, pos2[key], pos1[key]) for key in pos1},
+        {key: np.where(mask, pos1[key], pos2[key]) for key in pos2},
+    )
+
+
 class Strategy(ABC):
-    """组合策略基类"""
-    def __init__(self, pos1: pd.Series, pos2: pd.Series):
-        self._pos1, self._pos2 = self.modify_positions(pos1, pos2)
+    """
+    组合策略基类
+
+    组合条件与保证金只以数组形式定义 (to_swap_vec, is_valid_vec, calc_margin_vec);
+    单对持仓头寸的 modify_positions, is_valid 与 margin 均以单元素数组调用这些规则
+    """
+    # 组合策略适用的交易所, is_valid_vec 与批量分析的预筛选均以此为准
+    valid_exchanges: frozenset = frozenset()
+
+    def __init__(self, pos1: Position, pos2: Position,
+                 arrays: tuple[Positions, Positions] | None = None):
+        """
+        Args:
+            pos1 (Position): 第一笔持仓头寸
+            pos2 (Position): 第二笔持仓头寸
+            arrays (tuple, optional): 已调整顺序的两笔持仓头寸对应的单元素数组 (由分析器传入),
+                为 None 时由 pos1, pos2 转换并调整顺序
+        """
+        if arrays is None:
+            arrays = (_SinglePositions(pos1), _SinglePositions(pos2))
+            if self.to_swap_vec(*arrays)[0]:
+                pos1, pos2, arrays = pos2, pos1, arrays[::-1]
+        self._pos1, self._pos2 = pos1, pos2
+        self._arrays = arrays
 
     @staticmethod
-    @abstractmethod
-    def modify_positions(pos1: pd.Series, pos2: pd.Series) -> tuple[pd.Series, pd.Series]:
+    def to_swap_vec(pos1: Positions, pos2: Positions) -> np.ndarray:
+        """各对持仓头寸是否需要交换顺序, 返回 shape: (n_pair,)"""
+        return np.zeros(len(pos1['type']), dtype=bool)
+
+    @classmethod
+    def modify_positions(cls, pos1: Position, pos2: Position) -> tuple[Position, Position]:
         """调整两笔持仓头寸的顺序"""
+        if cls.to_swap_vec(_SinglePositions(pos1), _SinglePositions(pos2))[0]:
+            return pos2, pos1
+        return pos1, pos2
+
+    @classmethod
+    def modify_positions_vec(cls, pos1: Positions, pos2: Positions
+                             ) -> tuple[Positions, Positions]:
+        """modify_positions 的向量化版本"""
+        to_swap = cls.to_swap_vec(pos1, pos2)
+        if not to_swap.any():
+            return pos1, pos2
+        return _swap(pos1, pos2, to_swap)
+
+    @classmethod
+    def is_valid(cls, pos1: Position, pos2: Position, is_close: bool) -> bool:
+        """两笔持仓头寸是否能构成该组合策略"""
+        # 先做开销最小的交易所判断, 不适用时无需转换数组
+        if pos1['exchange'] not in cls.valid_exchanges:
+            return False
+        return bool(cls.is_matched_vec(_SinglePositions(pos1), _SinglePositions(pos2), is_close)[0])
+
+    @staticmethod
+    def is_candidate_vec(pos1: Positions, pos2: Positions) -> np.ndarray:
+        """同类组合策略共同的必要条件, 批量分析时据此预先剔除头寸对, 返回 shape: (n_pair,)"""
+        return np.ones(len(pos1['type']), dtype=bool)
+
+    @classmethod
+    def is_valid_vec(cls, pos1: Positions, pos2: Positions, is_close: bool) -> np.ndarray:
+        """is_valid 的向量化版本, 返回 shape: (n_pair,)"""
+        return (
+            np.isin(pos1['exchange'], list(cls.valid_exchanges)) &
+            cls.is_matched_vec(pos1, pos2, is_close)
+        )
+
+    @staticmethod
+    @abstractmethod
+    def is_matched_vec(pos1: Positions, pos2: Positions, is_close: bool) -> np.ndarray:
+        """交易所以外的组合条件, 返回 shape: (n_pair,)"""
         pass
 
     @staticmethod
     @abstractmethod
-    def is_valid(pos1: pd.Series, pos2: pd.Series, is_close: bool) -> bool:
-        """两笔持仓头寸是否能构成该组合策略"""
+    def calc_margin_vec(pos1: Positions, pos2: Positions) -> np.ndarray:
+        """计算一组持仓头寸对的组合保证金 (margin 的向量化版本), 返回 shape: (n_pair,)"""
         pass
 
     @property
@@ -37,10 +144,9 @@ class Strategy(ABC):
         return self.__class__.__name__
 
     @cached_property
-    @abstractmethod
     def margin(self) -> float:
         """组合保证金"""
-        pass
+        return float(self.calc_margin_vec(*self._arrays)[0])
 
     @cached_property
     def margin_saving(self) -> float:
@@ -51,379 +157,387 @@ class Strategy(ABC):
 class FuturesStrategy(Strategy):
     """期货组合基类"""
     @staticmethod
-    def modify_positions(pos1: pd.Series, pos2: pd.Series) -> tuple[pd.Series, pd.Series]:
-        return pos1, pos2
+    def is_candidate_vec(pos1: Positions, pos2: Positions) -> np.ndarray:
+        return pos1['long_short'] != pos2['long_short']
 
 
 class OptionsStrategy(Strategy):
     """期权组合基类"""
     @staticmethod
-    def modify_positions(pos1: pd.Series, pos2: pd.Series) -> tuple[pd.Series, pd.Series]:
-        if (
-            pos1['long_short'] == 'short' and
-            pos2['long_short'] == 'long'
-        ):
-            return pos2, pos1    # 若一多一空, 则保证后者为空
-        elif (
-            pos1['long_short'] == pos2['long_short'] and
-            pos1['call_put'] == 'call' and
-            pos2['call_put'] == 'put'
-        ):
-            return pos2, pos1    # 空头一看涨一看跌, 保证后者为看涨
-        else:
-            return pos1, pos2
+    def to_swap_vec(pos1: Positions, pos2: Positions) -> np.ndarray:
+        return (
+            # 若一多一空, 则保证后者为空
+            ((pos1['long_short'] == 'short') & (pos2['long_short'] == 'long')) |
+            (    # 空头一看涨一看跌, 保证后者为看涨
+                (pos1['long_short'] == pos2['long_short']) &
+                (pos1['call_put'] == 'call') &
+                (pos2['call_put'] == 'put')
+            )
+        )
+
+    @staticmethod
+    def is_candidate_vec(pos1: Positions, pos2: Positions) -> np.ndarray:
+        # 价差、跨式类要求同一标的, 对锁类要求同一合约
+        return (pos1['udl'] == pos2['udl']) | (pos1['code'] == pos2['code'])
 
 
 class FutureOptionStrategy(Strategy):
     """期货期权组合基类"""
     @staticmethod
-    def modify_positions(pos1: pd.Series, pos2: pd.Series) -> tuple[pd.Series, pd.Series]:
-        if pos1['type'] == PositionType.Option:
-            return pos2, pos1    # 保证pos1为期货, pos2为期权
-        else:
-            return pos1, pos2
+    def to_swap_vec(pos1: Positions, pos2: Positions) -> np.ndarray:
+        return pos1['type'] == PositionType.Option    # 保证pos1为期货, pos2为期权
+
+    @staticmethod
+    def is_candidate_vec(pos1: Positions, pos2: Positions) -> np.ndarray:
+        return pos1['code'] == pos2['udl']
 
 
 class FutureLockPosition(FuturesStrategy):
     """期货对锁组合"""
+    valid_exchanges = _EX_CZCE_DCE_GFEX
+
     @staticmethod
-    def is_valid(pos1: pd.Series, pos2: pd.Series, is_close: bool) -> bool:
-        exchange = pos1['exchange']
+    def is_matched_vec(pos1: Positions, pos2: Positions, is_close: bool) -> np.ndarray:
         return (
-            pos1['code'] == pos2['code'] and
-            pos1['long_short'] != pos2['long_short'] and
-            exchange in {Exchange.CZCE, Exchange.DCE, Exchange.GFEX}
+            (pos1['code'] == pos2['code']) &
+            (pos1['long_short'] != pos2['long_short'])
         )
 
-    @cached_property
-    def margin(self) -> float:
-        return max(self._pos1['margin'], self._pos2['margin'])
+    @staticmethod
+    def calc_margin_vec(pos1: Positions, pos2: Positions) -> np.ndarray:
+        return np.maximum(pos1['margin'], pos2['margin'])
 
 
 class CalendarSpread(FuturesStrategy):
     """期货跨期组合"""
+    valid_exchanges = _EX_CZCE_DCE_GFEX
+
     @staticmethod
-    def is_valid(pos1: pd.Series, pos2: pd.Series, is_close: bool) -> bool:
-        exchange = pos1['exchange']
+    def is_matched_vec(pos1: Positions, pos2: Positions, is_close: bool) -> np.ndarray:
         return (
-            pos1['variety'] == pos2['variety'] and
-            pos1['code'] != pos2['code'] and
-            pos1['long_short'] != pos2['long_short'] and
-            exchange in {Exchange.CZCE, Exchange.DCE, Exchange.GFEX}
+            (pos1['variety'] == pos2['variety']) &
+            (pos1['code'] != pos2['code']) &
+            (pos1['long_short'] != pos2['long_short'])
         )
 
-    @cached_property
-    def margin(self) -> float:
-        return max(self._pos1['margin'], self._pos2['margin'])
+    @staticmethod
+    def calc_margin_vec(pos1: Positions, pos2: Positions) -> np.ndarray:
+        return np.maximum(pos1['margin'], pos2['margin'])
 
 
 class InterCommoditySpread(FuturesStrategy):
     """期货跨品种组合"""
+    valid_exchanges = _EX_CZCE_DCE
+
     @staticmethod
-    def is_valid(pos1: pd.Series, pos2: pd.Series, is_close: bool) -> bool:
-        exchange = pos1['exchange']
+    def is_matched_vec(pos1: Positions, pos2: Positions, is_close: bool) -> np.ndarray:
         return (
-            Variety.is_commodity_pair(pos1['variety'], pos2['variety'], exchange) and
-            pos1['long_short'] != pos2['long_short'] and
-            exchange in {Exchange.CZCE, Exchange.DCE}
+            Variety.is_commodity_pair_vec(pos1['variety'], pos2['variety'], pos1['exchange']) &
+            (pos1['long_short'] != pos2['long_short'])
         )
 
-    @cached_property
-    def margin(self) -> float:
-        return max(self._pos1['margin'], self._pos2['margin'])
+    @staticmethod
+    def calc_margin_vec(pos1: Positions, pos2: Positions) -> np.ndarray:
+        return np.maximum(pos1['margin'], pos2['margin'])
 
 
 class BullCallSpread(OptionsStrategy):
     """牛市看涨价差组合"""
+    valid_exchanges = _EX_SSE_SZSE_DCE_GFEX
+
     @staticmethod
-    def is_valid(pos1: pd.Series, pos2: pd.Series, is_close: bool) -> bool:
-        exchange = pos1['exchange']
+    def is_matched_vec(pos1: Positions, pos2: Positions, is_close: bool) -> np.ndarray:
         return (
-            pos1['udl'] == pos2['udl'] and
-            pos1['last_tradedate'] == pos2['last_tradedate'] and
-            pos1['long_short'] != pos2['long_short'] and    # pos1 多, pos2 空
-            pos1['call_put'] == 'call' and
-            pos2['call_put'] == 'call' and
-            pos1['strike_price'] - pos2['strike_price'] < -1e-6 and
-            exchange in {Exchange.SSE, Exchange.SZSE, Exchange.DCE, Exchange.GFEX}
+            (pos1['udl'] == pos2['udl']) &
+            (pos1['last_tradedate'] == pos2['last_tradedate']) &
+            (pos1['long_short'] != pos2['long_short']) &
+            (pos1['call_put'] == 'call') &
+            (pos2['call_put'] == 'call') &
+            (pos1['strike_price'] - pos2['strike_price'] < -1e-6)
         )
 
-    @cached_property
-    def margin(self) -> float:
-        if self._pos1['exchange'] in {Exchange.SSE, Exchange.SZSE}:
-            return 0.0
-        else:
-            return self._pos2['margin'] * 0.2
+    @staticmethod
+    def calc_margin_vec(pos1: Positions, pos2: Positions) -> np.ndarray:
+        return np.where(np.isin(pos1['exchange'], list(_EX_SSE_SZSE)),
+                        0.0, pos2['margin'] * 0.2)
 
 
 class BearCallSpread(OptionsStrategy):
     """熊市看涨价差组合"""
+    valid_exchanges = _EX_SSE_SZSE_DCE_GFEX
+
     @staticmethod
-    def is_valid(pos1: pd.Series, pos2: pd.Series, is_close: bool) -> bool:
-        exchange = pos1['exchange']
+    def is_matched_vec(pos1: Positions, pos2: Positions, is_close: bool) -> np.ndarray:
         return (
-            pos1['udl'] == pos2['udl'] and
-            pos1['last_tradedate'] == pos2['last_tradedate'] and
-            pos1['long_short'] != pos2['long_short'] and    # pos1 多, pos2 空
-            pos1['call_put'] == 'call' and
-            pos2['call_put'] == 'call' and
-            pos1['strike_price'] - pos2['strike_price'] > 1e-6 and
-            exchange in {Exchange.SSE, Exchange.SZSE, Exchange.DCE, Exchange.GFEX}
+            (pos1['udl'] == pos2['udl']) &
+            (pos1['last_tradedate'] == pos2['last_tradedate']) &
+            (pos1['long_short'] != pos2['long_short']) &
+            (pos1['call_put'] == 'call') &
+            (pos2['call_put'] == 'call') &
+            (pos1['strike_price'] - pos2['strike_price'] > 1e-6)
         )
 
-    @cached_property
-    def margin(self) -> float:
-        return (self._pos1['strike_price'] - self._pos2['strike_price']) * self._pos1['multiplier']
+    @staticmethod
+    def calc_margin_vec(pos1: Positions, pos2: Positions) -> np.ndarray:
+        return (pos1['strike_price'] - pos2['strike_price']) * pos1['multiplier']
 
 
 class BullPutSpread(OptionsStrategy):
     """牛市看跌价差组合"""
+    valid_exchanges = _EX_SSE_SZSE_DCE_GFEX
+
     @staticmethod
-    def is_valid(pos1: pd.Series, pos2: pd.Series, is_close: bool) -> bool:
-        exchange = pos1['exchange']
+    def is_matched_vec(pos1: Positions, pos2: Positions, is_close: bool) -> np.ndarray:
         return (
-            pos1['udl'] == pos2['udl'] and
-            pos1['last_tradedate'] == pos2['last_tradedate'] and
-            pos1['long_short'] != pos2['long_short'] and    # pos1 多, pos2 空
-            pos1['call_put'] == 'put' and
-            pos2['call_put'] == 'put' and
-            pos1['strike_price'] - pos2['strike_price'] < -1e-6 and
-            exchange in {Exchange.SSE, Exchange.SZSE, Exchange.DCE, Exchange.GFEX}
+            (pos1['udl'] == pos2['udl']) &
+            (pos1['last_tradedate'] == pos2['last_tradedate']) &
+            (pos1['long_short'] != pos2['long_short']) &
+            (pos1['call_put'] == 'put') &
+            (pos2['call_put'] == 'put') &
+            (pos1['strike_price'] - pos2['strike_price'] < -1e-6)
         )
 
-    @cached_property
-    def margin(self) -> float:
-        return (self._pos2['strike_price'] - self._pos1['strike_price']) * self._pos2['multiplier']
+    @staticmethod
+    def calc_margin_vec(pos1: Positions, pos2: Positions) -> np.ndarray:
+        return (pos2['strike_price'] - pos1['strike_price']) * pos2['multiplier']
 
 
 class BearPutSpread(OptionsStrategy):
     """熊市看跌价差组合"""
+    valid_exchanges = _EX_SSE_SZSE_DCE_GFEX
+
     @staticmethod
-    def is_valid(pos1: pd.Series, pos2: pd.Series, is_close: bool) -> bool:
-        exchange = pos1['exchange']
+    def is_matched_vec(pos1: Positions, pos2: Positions, is_close: bool) -> np.ndarray:
         return (
-            pos1['udl'] == pos2['udl'] and
-            pos1['last_tradedate'] == pos2['last_tradedate'] and
-            pos1['long_short'] != pos2['long_short'] and    # pos1 多, pos2 空
-            pos1['call_put'] == 'put' and
-            pos2['call_put'] == 'put' and
-            pos1['strike_price'] - pos2['strike_price'] > 1e-6 and
-            exchange in {Exchange.SSE, Exchange.SZSE, Exchange.DCE, Exchange.GFEX}
+            (pos1['udl'] == pos2['udl']) &
+            (pos1['last_tradedate'] == pos2['last_tradedate']) &
+            (pos1['long_short'] != pos2['long_short']) &
+            (pos1['call_put'] == 'put') &
+            (pos2['call_put'] == 'put') &
+            (pos1['strike_price'] - pos2['strike_price'] > 1e-6)
         )
 
-    @cached_property
-    def margin(self) -> float:
-        if self._pos1['exchange'] in {Exchange.SSE, Exchange.SZSE}:
-            return 0.0
-        else:
-            return self._pos2['margin'] * 0.2
+    @staticmethod
+    def calc_margin_vec(pos1: Positions, pos2: Positions) -> np.ndarray:
+        return np.where(np.isin(pos1['exchange'], list(_EX_SSE_SZSE)),
+                        0.0, pos2['margin'] * 0.2)
 
 
 class Straddle(OptionsStrategy):
     """跨式组合"""
+    valid_exchanges = _EX_SSE_SZSE_CZCE_DCE_GFEX
+
     @staticmethod
-    def is_valid(pos1: pd.Series, pos2: pd.Series, is_close: bool) -> bool:
-        exchange = pos1['exchange']
+    def is_matched_vec(pos1: Positions, pos2: Positions, is_close: bool) -> np.ndarray:
         return (
-            pos1['udl'] == pos2['udl'] and
-            pos1['last_tradedate'] == pos2['last_tradedate'] and
-            pos1['long_short'] == 'short' and
-            pos2['long_short'] == 'short' and
-            pos1['call_put'] != pos2['call_put'] and    # pos1 看跌, pos2 看涨
-            abs(pos1['strike_price'] - pos2['strike_price']) < 1e-6 and
-            exchange in {Exchange.SSE, Exchange.SZSE, Exchange.CZCE, Exchange.DCE, Exchange.GFEX}
+            (pos1['udl'] == pos2['udl']) &
+            (pos1['last_tradedate'] == pos2['last_tradedate']) &
+            (pos1['long_short'] == 'short') &
+            (pos2['long_short'] == 'short') &
+            (pos1['call_put'] != pos2['call_put']) &
+            (np.abs(pos1['strike_price'] - pos2['strike_price']) < 1e-6)
         )
 
-    @cached_property
-    def margin(self) -> float:
-        return self.calc_margin(self._pos1, self._pos2)
-
     @staticmethod
-    def calc_margin(pos1: pd.Series, pos2: pd.Series) -> float:
-        if pos1['margin'] - pos2['margin'] > 1e-6:
-            pos_higher, pos_lower = pos1, pos2
-        elif pos1['margin'] - pos2['margin'] < -1e-6:
-            pos_higher, pos_lower = pos2, pos1
-        else:
-            if pos1['close_price'] - pos2['close_price'] > 1e-6:
-                pos_higher, pos_lower = pos1, pos2
-            else:
-                pos_higher, pos_lower = pos2, pos1
-        return pos_higher['margin'] + pos_lower['close_price'] * pos_lower['multiplier']
+    def calc_margin_vec(pos1: Positions, pos2: Positions) -> np.ndarray:
+        margin_diff = pos1['margin'] - pos2['margin']
+        pos1_higher = (margin_diff > 1e-6) | (
+            ~(margin_diff < -1e-6) & (pos1['close_price'] - pos2['close_price'] > 1e-6))
+        return np.where(pos1_higher,
+                        pos1['margin'] + pos2['close_price'] * pos2['multiplier'],
+                        pos2['margin'] + pos1['close_price'] * pos1['multiplier'])
 
 
 class Strangle(OptionsStrategy):
     """宽跨式组合"""
+    valid_exchanges = _EX_SSE_SZSE_CZCE_DCE_GFEX
+
     @staticmethod
-    def is_valid(pos1: pd.Series, pos2: pd.Series, is_close: bool) -> bool:
-        exchange = pos1['exchange']
+    def is_matched_vec(pos1: Positions, pos2: Positions, is_close: bool) -> np.ndarray:
         return (
-            pos1['udl'] == pos2['udl'] and
-            pos1['last_tradedate'] == pos2['last_tradedate'] and
-            pos1['long_short'] == 'short' and
-            pos2['long_short'] == 'short' and
-            pos1['call_put'] != pos2['call_put'] and    # pos1 看跌, pos2 看涨
-            pos1['strike_price'] - pos2['strike_price'] < -1e-6 and
-            exchange in {Exchange.SSE, Exchange.SZSE, Exchange.CZCE, Exchange.DCE, Exchange.GFEX}
+            (pos1['udl'] == pos2['udl']) &
+            (pos1['last_tradedate'] == pos2['last_tradedate']) &
+            (pos1['long_short'] == 'short') &
+            (pos2['long_short'] == 'short') &
+            (pos1['call_put'] != pos2['call_put']) &
+            (pos1['strike_price'] - pos2['strike_price'] < -1e-6)
         )
 
-    @cached_property
-    def margin(self) -> float:
-        return Straddle.calc_margin(self._pos1, self._pos2)
+    @staticmethod
+    def calc_margin_vec(pos1: Positions, pos2: Positions) -> np.ndarray:
+        return Straddle.calc_margin_vec(pos1, pos2)
 
 
 class OptionLockPosition(OptionsStrategy):
     """期权对锁组合"""
+    valid_exchanges = _EX_DCE_GFEX
+
     @staticmethod
-    def is_valid(pos1: pd.Series, pos2: pd.Series, is_close: bool) -> bool:
-        exchange = pos1['exchange']
+    def is_matched_vec(pos1: Positions, pos2: Positions, is_close: bool) -> np.ndarray:
         return (
-            pos1['code'] == pos2['code'] and
-            pos1['long_short'] != pos2['long_short'] and
-            exchange in {Exchange.DCE, Exchange.GFEX}
+            (pos1['code'] == pos2['code']) &
+            (pos1['long_short'] != pos2['long_short'])
         )
 
-    @cached_property
-    def margin(self) -> float:
-        return self._pos2['margin'] * 0.2
+    @staticmethod
+    def calc_margin_vec(pos1: Positions, pos2: Positions) -> np.ndarray:
+        return pos2['margin'] * 0.2
 
 
 class AutoHedging(OptionsStrategy):
     """期权自动对冲"""
+    valid_exchanges = _EX_SSE_SZSE
+
     @staticmethod
-    def is_valid(pos1: pd.Series, pos2: pd.Series, is_close: bool) -> bool:
-        exchange = pos1['exchange']
+    def is_matched_vec(pos1: Positions, pos2: Positions, is_close: bool) -> np.ndarray:
         return (
-            pos1['code'] == pos2['code'] and
-            pos1['long_short'] != pos2['long_short'] and
-            exchange in {Exchange.SSE, Exchange.SZSE} and
+            (pos1['code'] == pos2['code']) &
+            (pos1['long_short'] != pos2['long_short']) &
             is_close
         )
 
-    @cached_property
-    def margin(self) -> float:
-        return 0.0
+    @staticmethod
+    def calc_margin_vec(pos1: Positions, pos2: Positions) -> np.ndarray:
+        return np.zeros(len(pos1['margin']))
 
 
 class CoveredCall(FutureOptionStrategy):
     """备兑看涨组合 (看涨期权空头 + 期货多头)"""
+    valid_exchanges = _EX_DCE_GFEX
+
     @staticmethod
-    def is_valid(pos1: pd.Series, pos2: pd.Series, is_close: bool) -> bool:
-        exchange = pos1['exchange']
+    def is_matched_vec(pos1: Positions, pos2: Positions, is_close: bool) -> np.ndarray:
         return (
-            pos1['code'] == pos2['udl'] and
-            pos1['long_short'] == 'long' and
-            pos2['long_short'] == 'short' and
-            pos2['call_put'] == 'call' and
-            exchange in {Exchange.DCE, Exchange.GFEX}
+            (pos1['code'] == pos2['udl']) &
+            (pos1['long_short'] == 'long') &
+            (pos2['long_short'] == 'short') &
+            (pos2['call_put'] == 'call')
         )
 
-    @cached_property
-    def margin(self) -> float:
-        return self._pos1['margin'] + self._pos2['close_price'] * self._pos2['multiplier']
+    @staticmethod
+    def calc_margin_vec(pos1: Positions, pos2: Positions) -> np.ndarray:
+        return pos1['margin'] + pos2['close_price'] * pos2['multiplier']
 
 
 class CoveredPut(FutureOptionStrategy):
     """备兑看跌组合 (看跌期权空头 + 期货空头)"""
+    valid_exchanges = _EX_DCE_GFEX
+
     @staticmethod
-    def is_valid(pos1: pd.Series, pos2: pd.Series, is_close: bool) -> bool:
-        exchange = pos1['exchange']
+    def is_matched_vec(pos1: Positions, pos2: Positions, is_close: bool) -> np.ndarray:
         return (
-            pos1['code'] == pos2['udl'] and
-            pos1['long_short'] == 'short' and
-            pos2['long_short'] == 'short' and
-            pos2['call_put'] == 'put' and
-            exchange in {Exchange.DCE, Exchange.GFEX}
+            (pos1['code'] == pos2['udl']) &
+            (pos1['long_short'] == 'short') &
+            (pos2['long_short'] == 'short') &
+            (pos2['call_put'] == 'put')
         )
 
-    @cached_property
-    def margin(self) -> float:
-        return self._pos1['margin'] + self._pos2['close_price'] * self._pos2['multiplier']
+    @staticmethod
+    def calc_margin_vec(pos1: Positions, pos2: Positions) -> np.ndarray:
+        return pos1['margin'] + pos2['close_price'] * pos2['multiplier']
 
 
 class ProtectiveCall(FutureOptionStrategy):
     """保护性看涨组合 (看涨期权多头 + 期货空头)"""
+    valid_exchanges = _EX_DCE
+
     @staticmethod
-    def is_valid(pos1: pd.Series, pos2: pd.Series, is_close: bool) -> bool:
-        exchange = pos1['exchange']
+    def is_matched_vec(pos1: Positions, pos2: Positions, is_close: bool) -> np.ndarray:
         return (
-            pos1['code'] == pos2['udl'] and
-            pos1['long_short'] == 'short' and
-            pos2['long_short'] == 'long' and
-            pos2['call_put'] == 'call' and
-            exchange == Exchange.DCE
+            (pos1['code'] == pos2['udl']) &
+            (pos1['long_short'] == 'short') &
+            (pos2['long_short'] == 'long') &
+            (pos2['call_put'] == 'call')
         )
 
-    @cached_property
-    def margin(self) -> float:
-        return self._pos1['margin'] * 0.8
+    @staticmethod
+    def calc_margin_vec(pos1: Positions, pos2: Positions) -> np.ndarray:
+        return pos1['margin'] * 0.8
 
 
 class ProtectivePut(FutureOptionStrategy):
     """保护性看跌组合 (看跌期权多头 + 期货多头)"""
+    valid_exchanges = _EX_DCE
+
     @staticmethod
-    def is_valid(pos1: pd.Series, pos2: pd.Series, is_close: bool) -> bool:
-        exchange = pos1['exchange']
+    def is_matched_vec(pos1: Positions, pos2: Positions, is_close: bool) -> np.ndarray:
         return (
-            pos1['code'] == pos2['udl'] and
-            pos1['long_short'] == 'long' and
-            pos2['long_short'] == 'long' and
-            pos2['call_put'] == 'put' and
-            exchange == Exchange.DCE
+            (pos1['code'] == pos2['udl']) &
+            (pos1['long_short'] == 'long') &
+            (pos2['long_short'] == 'long') &
+            (pos2['call_put'] == 'put')
         )
 
-    @cached_property
-    def margin(self) -> float:
-        return self._pos1['margin'] * 0.8
+    @staticmethod
+    def calc_margin_vec(pos1: Positions, pos2: Positions) -> np.ndarray:
+        return pos1['margin'] * 0.8
+
+
+# 各类组合策略按交易所筛选后的列表 (保持定义顺序), 在所有组合策略定义完成后构建
+_STRATEGIES_BY_EXCHANGE = {
+    (family, exchange): tuple(
+        strategy for strategy in family.__subclasses__() if exchange in strategy.valid_exchanges)
+    for family in (FuturesStrategy, OptionsStrategy, FutureOptionStrategy)
+    for exchange in Exchange.EquityExchanges | Exchange.CommodityExchanges
+}
+
+
+def _strategies_for(family: type[Strategy], exchange: str) -> tuple[type[Strategy], ...]:
+    """某类组合策略中适用于指定交易所的组合策略"""
+    return _STRATEGIES_BY_EXCHANGE.get((family, exchange), ())
 
 
 class StrategyAnalyzer(ABC):
     """组合策略分析器基类"""
-    def __init__(self, pos1: pd.Series, pos2: pd.Series, is_close: bool):
+    def __init__(self, pos1: Position, pos2: Position, is_close: bool):
         self.pos1 = pos1
         self.pos2 = pos2
         self.is_close = is_close
+        # 组合规则所用字段只在此转换一次, 各组合策略的判断与保证金计算共用
+        self._arrays = (_SinglePositions(pos1), _SinglePositions(pos2))
 
     @abstractmethod
     def analyze(self) -> Strategy | None:
         """分析两笔持仓头寸所能构成的组合策略"""
         pass
 
+    def _analyze(self, family: type[Strategy]) -> Strategy | None:
+        """按同类组合策略的定义顺序, 返回第一个成立的组合策略"""
+        if family.to_swap_vec(*self._arrays)[0]:
+            self.pos1, self.pos2 = self.pos2, self.pos1
+            self._arrays = self._arrays[::-1]
+        # 与批量分析一致, 先以同类组合策略的共同条件剔除
+        if not family.is_candidate_vec(*self._arrays)[0]:
+            return None
+        # _strategies_for 已按交易所筛选, 只需判断其余组合条件
+        for strategy in _strategies_for(family, self._arrays[0]['exchange'][0]):
+            if strategy.is_matched_vec(*self._arrays, self.is_close)[0]:
+                return strategy(self.pos1, self.pos2, arrays=self._arrays)
+        return None
+
 
 class FuturesStrategyAnalyzer(StrategyAnalyzer):
     """期货组合策略分析器"""
     def analyze(self) -> Strategy | None:
-        self.pos1, self.pos2 = FuturesStrategy.modify_positions(self.pos1, self.pos2)
-        for strategy in FuturesStrategy.__subclasses__():
-            if strategy.is_valid(self.pos1, self.pos2, self.is_close):
-                return strategy(self.pos1, self.pos2)
-        return None
+        return self._analyze(FuturesStrategy)
 
 
 class OptionsStrategyAnalyzer(StrategyAnalyzer):
     """期权组合策略分析器"""
     def analyze(self) -> Strategy | None:
-        self.pos1, self.pos2 = OptionsStrategy.modify_positions(self.pos1, self.pos2)
-        for strategy in OptionsStrategy.__subclasses__():
-            if strategy.is_valid(self.pos1, self.pos2, self.is_close):
-                return strategy(self.pos1, self.pos2)
-        return None
+        return self._analyze(OptionsStrategy)
 
 
 class FutureOptionStrategyAnalyzer(StrategyAnalyzer):
     """期货期权组合策略分析器"""
     def analyze(self) -> Strategy | None:
-        self.pos1, self.pos2 = FutureOptionStrategy.modify_positions(self.pos1, self.pos2)
-        for strategy in FutureOptionStrategy.__subclasses__():
-            if strategy.is_valid(self.pos1, self.pos2, self.is_close):
-                return strategy(self.pos1, self.pos2)
-        return None
+        return self._analyze(FutureOptionStrategy)
 
 
 class StrategyAnalyzerFactory:
     """组合策略分析器工厂类"""
     @staticmethod
-    def create(pos1: pd.Series, pos2: pd.Series, is_close: bool) -> StrategyAnalyzer:
+    def create(pos1: Position, pos2: Position, is_close: bool) -> StrategyAnalyzer:
         """根据两笔持仓头寸类型, 创建对应的组合策略分析器"""
         analyzer_map = {
             (PositionType.Future, PositionType.Future): FuturesStrategyAnalyzer,
@@ -436,3 +550,58 @@ class StrategyAnalyzerFactory:
             return analyzer(pos1, pos2, is_close)
         else:
             raise ValueError('Invalid position types.')
+
+
+class StrategyBatchAnalyzer:
+    """组合策略批量分析器: 以数组运算一次性分析所有持仓头寸对, 结果与逐对分析一致"""
+    families = {
+        (PositionType.Future, PositionType.Future): FuturesStrategy,
+        (PositionType.Option, PositionType.Option): OptionsStrategy,
+        (PositionType.Future, PositionType.Option): FutureOptionStrategy,
+        (PositionType.Option, PositionType.Future): FutureOptionStrategy,
+    }
+
+    @staticmethod
+    def analyze(pos1: Positions, pos2: Positions, is_close: bool
+                ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        分析各组持仓头寸对所能构成的组合策略
+
+        Args:
+            pos1 (Positions): 各对的第一笔持仓头寸
+            pos2 (Positions): 各对的第二笔持仓头寸
+            is_close (bool): 是否为平仓
+
+        Returns:
+            tuple[ndarray, ndarray]: 组合策略类型 (不能构成组合的为 None) 与组合保证金,
+                shape: (n_pair,)
+        """
+        n_pair = len(pos1['type'])
+        strategy_types = np.full(n_pair, None, dtype=object)
+        margins = np.full(n_pair, np.nan)
+        for (type1, type2), family in StrategyBatchAnalyzer.families.items():
+            family_idx = np.flatnonzero((pos1['type'] == type1) & (pos2['type'] == type2))
+            family_pos1, family_pos2 = family.modify_positions_vec(
+                _take(pos1, family_idx), _take(pos2, family_idx))
+            # 先以同类组合策略的共同条件剔除, 各组合策略只判断剩余的头寸对
+            is_candidate = family.is_candidate_vec(family_pos1, family_pos2)
+            family_idx = family_idx[is_candidate]
+            family_pos1 = _take(family_pos1, is_candidate)
+            family_pos2 = _take(family_pos2, is_candidate)
+            unmatched = np.ones(len(family_idx), dtype=bool)
+            # 只判断适用于这些头寸对所属交易所的组合策略
+            exchanges = pd.unique(family_pos1['exchange'])    # 按哈希去重, 通常只有一个交易所
+            # 与逐对分析相同, 按定义顺序取第一个成立的组合策略
+            for strategy in family.__subclasses__():
+                if strategy.valid_exchanges.isdisjoint(exchanges):
+                    continue
+                if not unmatched.any():
+                    break
+                valid = unmatched & strategy.is_valid_vec(family_pos1, family_pos2, is_close)
+                if not valid.any():
+                    continue
+                strategy_types[family_idx[valid]] = strategy.__name__
+                margins[family_idx[valid]] = strategy.calc_margin_vec(
+                    _take(family_pos1, valid), _take(family_pos2, valid))
+                unmatched &= ~valid
+        return strategy_types, margins